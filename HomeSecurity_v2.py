@@ -1,31 +1,158 @@
-import cv2
+import time
+
+STARTED = time.perf_counter()
+
+import importlib
+import threading
 import tkinter as tk
-from PIL import Image, ImageTk
-import sqlite3
 from tkinter import messagebox
 
-# Create a connection to the SQLite database
-conn = sqlite3.connect("HomeSecurity.db")
-cursor = conn.cursor()
-
-# Create the table if it doesn't exist
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT,
-        birthday TEXT
-    )
-""")
-conn.commit()
-
-class HomePage:
-    def __init__(self):
+from credentials import CredentialStore
+
+# OpenCV, numpy and PIL are only imported once the camera is needed, so the homepage shows up first
+IMPORTED = time.perf_counter()
+
+# Thumbnails of the latest motion events shown below the live video
+RECENT_EVENTS = 6
+
+# Seconds the camera gets to deliver its first frame before opening it counts as failed
+CAMERA_TIMEOUT = 5.0
+
+class HomeSecurityApp:
+    def __init__(self, **camera_options):
+        # One root window for the whole session, the screens are frames swapped in and out of it
         self.root = tk.Tk()
-        self.root.title("Homepage")
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
+        self.screen = None
+
+        # User accounts, password checks run on the store's worker thread
+        self.credentials = CredentialStore("HomeSecurity.db")
+        self.session = None
+
+        # The camera pipeline is opened on the first login and kept running across logout and login
+        self.camera_options = camera_options
+        self.pipeline = None
+        self.prewarm_thread = None
+        self.prewarm_error = None
+
+        # Startup milestones in seconds since the process started importing this module
+        self.startup = {"imports": IMPORTED - STARTED}
+        self.login_time = None
+
+    def show(self, screen_class, *args, **kwargs):
+        # Replace the current screen with a new one
+        if self.screen is not None:
+            self.screen.close()
+        self.screen = screen_class(self, *args, **kwargs)
+
+    def prewarm(self):
+        # Open the camera and warm up the pipeline in the background while the user types their password
+        if self.pipeline is None and self.prewarm_thread is None:
+            self.prewarm_thread = threading.Thread(target=self.open_camera, daemon=True)
+            self.prewarm_thread.start()
+
+    def open_camera(self):
+        start = time.perf_counter()
+        try:
+            # Pull in OpenCV, numpy and PIL only now. The live video screen's modules are only
+            # imported to load them here on the background thread instead of on the Tk thread later.
+            from pipeline import CameraPipeline
+            importlib.import_module("display")
+            importlib.import_module("zone_editor")
+            # Browsers watching the stream need the token of a logged in session
+            pipeline = CameraPipeline(check_session=self.credentials.check_session, **self.camera_options)
+            # A missing camera doesn't raise, the grabber just never delivers a frame
+            ret, frame = pipeline.video.read(timeout=CAMERA_TIMEOUT)
+            if not ret:
+                pipeline.close()
+                raise RuntimeError("no frames from camera %s within %.0f seconds" % (pipeline.camera, CAMERA_TIMEOUT))
+            # Run the first frame through detection so buffers, the background model and OpenCV's own
+            # first-call setup are done before the first real frame
+            pipeline.detector.detect(frame)
+            self.pipeline = pipeline
+        except Exception as error:
+            self.prewarm_error = error
+        self.startup["camera_open"] = time.perf_counter() - start
+
+    def camera(self):
+        # The running pipeline, or None while it is still being opened in the background; never waits.
+        # Raises the error if opening failed, the next call tries again.
+        self.prewarm()
+        if self.prewarm_thread is not None:
+            if self.prewarm_thread.is_alive():
+                return None
+            self.prewarm_thread = None
+            if self.prewarm_error is not None:
+                error, self.prewarm_error = self.prewarm_error, None
+                raise error
+        if self.pipeline.root is None:
+            self.pipeline.start(self.root)
+        return self.pipeline
+
+    def first_frame(self):
+        # Called when the video screen draws its first frame after a login
+        if self.login_time is not None:
+            self.startup["login_to_first_frame"] = time.perf_counter() - self.login_time
+            self.login_time = None
+            self.report_startup()
+
+    def report_startup(self):
+        print("Startup: " + ", ".join("%s %.0f ms" % (name.replace("_", " "), seconds * 1000.0)
+                                      for name, seconds in self.startup.items()))
+
+    def run(self):
+        self.show(HomePage)
+
+        # Draw the homepage before anything else happens
+        self.root.update()
+        self.startup["first_window"] = time.perf_counter() - STARTED
+        self.root.mainloop()
+
+    def quit(self):
+        # Release the camera and stop the password worker when the application is closed
+        if self.pipeline is not None:
+            self.pipeline.close()
+        self.credentials.close()
+        self.root.destroy()
+
+class Screen:
+    def __init__(self, app, title):
+        # Every screen draws into its own frame on the application's root window
+        self.app = app
+        self.app.root.title(title)
+        self.root = tk.Frame(app.root)
+        self.root.pack()
+
+        # Pending poll of a worker future, cancelled when the screen goes away
+        self.wait_job = None
+
+    def wait_for(self, future, on_done, *widgets):
+        # Call on_done with the result of a worker future without blocking the window. The given widgets,
+        # the action and every button that leaves the screen, are disabled until then so the request can't
+        # be sent twice and the screen stays up to receive the result.
+        self.wait_job = None
+        if not future.done():
+            for widget in widgets:
+                widget.config(state=tk.DISABLED)
+            self.wait_job = self.app.root.after(20, self.wait_for, future, on_done, *widgets)
+            return
+        for widget in widgets:
+            widget.config(state=tk.NORMAL)
+        on_done(future.result())
+
+    def close(self):
+        if self.wait_job is not None:
+            self.app.root.after_cancel(self.wait_job)
+            self.wait_job = None
+        self.root.destroy()
+
+class HomePage(Screen):
+    def __init__(self, app):
+        Screen.__init__(self, app, "Homepage")
 
         # Create a label widget for the image or logo
-        image = tk.PhotoImage(file="logo.png")  # Replace "logo.png" with the path to your image file
-        image_label = tk.Label(self.root, image=image)
+        self.image = tk.PhotoImage(file="logo.png")  # Replace "logo.png" with the path to your image file
+        image_label = tk.Label(self.root, image=self.image)
         image_label.pack()
 
         # Create a label widget for the text
@@ -39,26 +166,17 @@ class HomePage:
         signup_button = tk.Button(self.root, text="Signup", font=("Helvetica", 12), width=10, command=self.signup)
         signup_button.pack(pady=5)
 
-        self.root.mainloop()
-
     def login(self):
-        # Destroy the homepage window
-        self.root.destroy()
-
-        # Create an instance of the LoginSignupApp class
-        login_app = LoginSignupApp()
+        # Switch to the login screen
+        self.app.show(LoginSignupApp)
 
     def signup(self):
-        # Destroy the homepage window
-        self.root.destroy()
+        # Switch to the login screen with the signup flag set to True
+        self.app.show(LoginSignupApp, signup=True)
 
-        # Create an instance of the LoginSignupApp class with the signup flag set to True
-        signup_app = LoginSignupApp(signup=True)
-
-class LoginSignupApp:
-    def __init__(self, signup=False):
-        self.root = tk.Tk()
-        self.root.title("Login/Signup")
+class LoginSignupApp(Screen):
+    def __init__(self, app, signup=False):
+        Screen.__init__(self, app, "Login/Signup")
 
         self.signup = signup
 
@@ -88,134 +206,158 @@ class LoginSignupApp:
 
         # Create login or signup button
         if self.signup:
-            action_button = tk.Button(self.root, text="Signup", command=self.perform_signup)
+            self.action_button = tk.Button(self.root, text="Signup", command=self.perform_signup)
         else:
-            action_button = tk.Button(self.root, text="Login", command=self.perform_login)
-        action_button.pack(pady=5)
+            self.action_button = tk.Button(self.root, text="Login", command=self.perform_login)
+            # Get the camera ready while the user is typing
+            self.app.prewarm()
+        self.action_button.pack(pady=5)
 
         # Create a forgot password button
-        forgot_password_button = tk.Button(self.root, text="Forgot Password?", command=self.forgot_password)
-        forgot_password_button.pack(pady=5)
-
-        self.root.mainloop()
+        self.forgot_button = tk.Button(self.root, text="Forgot Password?", command=self.forgot_password)
+        self.forgot_button.pack(pady=5)
 
     def perform_login(self):
         username = self.username_entry.get()
         password = self.password_entry.get()
 
-        # Check if the username and password match a record in the database
-        cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-        user = cursor.fetchone()
-
-        if user:
-            self.show_message2("Login successful!")
-            self.root.destroy()
-            # Create an instance of the MotionDetectionApp class
-            app = MotionDetectionApp()
+        # Check the password against its stored hash on the worker thread
+        credentials = self.app.credentials
+        self.wait_for(credentials.submit(credentials.login, username, password), self.finish_login,
+                      self.action_button, self.forgot_button)
+
+    def finish_login(self, session):
+        if session:
+            messagebox.showinfo("Message", "Login successful!")
+            # Switch to the live video
+            self.app.session = session
+            self.app.login_time = time.perf_counter()
+            self.app.show(MotionDetectionApp)
         else:
-            self.show_message2("Invalid username or password.")
-            self.root.destroy()
-            # Create an instance of the HomePage class
-            homepage = HomePage()
-
-    def show_message2(self, message):
-        # Create a message box to display the message
-        result = messagebox.showinfo("Message", message)
-
-        # Redirect to the MotionDetectionApp if OK button is pressed
-        if result == 'ok':
-            self.root.destroy()
-            app = MotionDetectionApp()
+            messagebox.showinfo("Message", "Invalid username or password.")
+            # Go back to the homepage
+            self.app.show(HomePage)
 
     def perform_signup(self):
         username = self.username_entry.get()
         password = self.password_entry.get()
         birthday = self.birthday_entry.get()
     
-        # Check if the username already exists in the database
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        existing_user = cursor.fetchone()
-    
-        if existing_user:
-            self.show_message("Username already exists. Please choose a different username.")
-        else:
-            # Insert the user data into the users table
-            cursor.execute("INSERT INTO users (username, password, birthday) VALUES (?, ?, ?)", (username, password, birthday))
-            conn.commit()
-    
+        # Hash the password and insert the user on the worker thread
+        credentials = self.app.credentials
+        self.wait_for(credentials.submit(credentials.signup, username, password, birthday), self.finish_signup,
+                      self.action_button, self.forgot_button)
+
+    def finish_signup(self, created):
+        if created:
             self.show_message("Signup successful!")
+        else:
+            messagebox.showinfo("Message", "Username already exists. Please choose a different username.")
     
     def show_message(self, message):
         # Create a message box to display the message
         result = messagebox.showinfo("Message", message)
     
-        # Redirect to the LoginSignupApp if OK button is pressed
+        # Redirect to the login screen if OK button is pressed
         if result == 'ok':
-            self.root.destroy()
-            login_signup_app = LoginSignupApp()
+            self.app.show(LoginSignupApp)
 
     def forgot_password(self):
-        # Destroy the login/signup window
-        self.root.destroy()
+        # Switch to the password recovery screen
+        self.app.show(ForgotPasswordApp)
 
-        # Create an instance of the ForgotPasswordApp class
-        forgot_password_app = ForgotPasswordApp()
-
-    def __del__(self):
-        # Close the database connection when the application is closed
-        conn.close()
-
-class ForgotPasswordApp:
-    def __init__(self):
-        self.root = tk.Tk()
-        self.root.title("Forgot Password")
+class ForgotPasswordApp(Screen):
+    def __init__(self, app):
+        Screen.__init__(self, app, "Forgot Password")
 
         # Create a label widget for the title
         title_label = tk.Label(self.root, text="Forgot Password", font=("Helvetica", 16), pady=10)
         title_label.pack()
 
-        # Create an entry widget for the username
+        # Create entry widgets for the username, the birthday given at signup and the new password
         username_label = tk.Label(self.root, text="Username:")
         username_label.pack()
         self.username_entry = tk.Entry(self.root)
         self.username_entry.pack()
 
-        # Create a button to initiate password recovery
-        recover_button = tk.Button(self.root, text="Recover Password", command=self.recover_password)
-        recover_button.pack(pady=5)
+        birthday_label = tk.Label(self.root, text="Birthday:")
+        birthday_label.pack()
+        self.birthday_entry = tk.Entry(self.root)
+        self.birthday_entry.pack()
 
-        self.root.mainloop()
+        password_label = tk.Label(self.root, text="New Password:")
+        password_label.pack()
+        self.password_entry = tk.Entry(self.root, show="*")
+        self.password_entry.pack()
+
+        # Create a button to set the new password
+        self.recover_button = tk.Button(self.root, text="Reset Password", command=self.recover_password)
+        self.recover_button.pack(pady=5)
 
     def recover_password(self):
         username = self.username_entry.get()
+        birthday = self.birthday_entry.get()
+        password = self.password_entry.get()
 
-        # Check if the username exists in the database
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
+        # Passwords are stored as hashes and can't be shown, set a new one if the birthday matches
+        credentials = self.app.credentials
+        self.wait_for(credentials.submit(credentials.reset_password, username, birthday, password), self.finish_recovery, self.recover_button)
 
-        if user:
-            password = user[1]  # Assuming the password is stored at index 2
-            self.show_message(f"Your password is: {password}")
+    def finish_recovery(self, changed):
+        if changed:
+            self.show_message("Your password has been changed.")
         else:
-            self.show_message("Username not found.")
+            messagebox.showinfo("Message", "Username and birthday don't match.")
 
     def show_message(self, message):
         # Create a message box to display the message
         messagebox.showinfo("Message", message)
 
-        # Redirect to the LoginSignupApp
-        self.root.destroy()
-        homepage = HomePage()
+        # Redirect to the homepage
+        self.app.show(HomePage)
 
-    def __del__(self):
-        # Close the database connection when the application is closed
-        conn.close()
-
-class MotionDetectionApp:
-    def __init__(self, video_source=0):
-        self.root = tk.Tk()
-        self.root.title("Home Security")
+class MotionDetectionApp(Screen):
+    def __init__(self, app):
+        Screen.__init__(self, app, "Home Security")
+        self.pipeline = None
+        self.events_job = None
         
+        # Only reachable with a live session, checking it doesn't hash anything
+        if app.credentials.check_session(app.session) is None:
+            app.root.after_idle(app.show, HomePage)
+            return
+        
+        # The camera may still be opening in the background, show the screen now and the video once it is ready
+        self.opening_label = tk.Label(self.root, text="Opening camera...", font=("Helvetica", 12), pady=20)
+        self.opening_label.pack()
+        self.wait_job = app.root.after_idle(self.wait_for_camera)
+
+    def wait_for_camera(self):
+        # Polled from the Tk loop so a slow camera never freezes the window
+        self.wait_job = None
+        try:
+            pipeline = self.app.camera()
+        except Exception as error:
+            # Nothing to show without a camera, end the session and go back to the homepage
+            messagebox.showerror("Camera", "Could not open the camera: %s" % error)
+            self.logout()
+            return
+        if pipeline is None:
+            self.wait_job = self.app.root.after(50, self.wait_for_camera)
+            return
+        self.opening_label.destroy()
+        self.show_camera(pipeline)
+
+    def show_camera(self, pipeline):
+        # Loaded by the time the camera is open
+        from display import CanvasDisplay, OverlayPool
+        from zone_editor import ZoneEditor
+        from zones import EXCLUDE, INCLUDE
+        app = self.app
+
+        # The camera keeps running between logins, this screen only shows it
+        self.pipeline = pipeline
+
         # Create a label widget for the title
         title_label = tk.Label(self.root, text="Home Security", font=("Helvetica", 16), pady=10)
         title_label.pack()
@@ -224,113 +366,129 @@ class MotionDetectionApp:
         canvas_label = tk.Label(self.root, text="Live Video Feed")
         canvas_label.pack()
         
-        # Open the video source
-        self.video = cv2.VideoCapture(video_source)
-        
         # Create a canvas to display the video
-        self.canvas = tk.Canvas(self.root, width=self.video.get(3), height=self.video.get(4))
+        self.canvas = tk.Canvas(self.root, width=self.pipeline.video.get(3), height=self.pipeline.video.get(4))
         self.canvas.pack()
         
-        # Initialize the previous frame
-        self.prev_frame = None
+        # Draw frames into a single canvas image that is updated in place
+        self.display = CanvasDisplay(self.canvas)
+        
+        # Create a label widget for the frame rates and render time
+        self.status_label = tk.Label(self.root, text="")
+        self.status_label.pack()
+        
+        # Create a row of labels for the thumbnails of the latest motion events
+        event_frame = tk.Frame(self.root)
+        event_frame.pack(pady=5)
+        self.event_labels = [tk.Label(event_frame, compound=tk.TOP, font=("Helvetica", 8)) for _ in range(RECENT_EVENTS)]
+        for label in self.event_labels:
+            label.pack(side=tk.LEFT, padx=2)
+        self.event_photos = {}
+        if self.pipeline.snapshots is not None:
+            self.refresh_events()
+
+        # Create a fixed pool of canvas items used to mark the motion regions
+        self.overlays = OverlayPool(self.canvas)
         
-        # Create a dictionary to store labels for each motion region
-        self.motion_labels = {}
+        # Let the user edit the camera's detection zones on the canvas
+        self.zone_editor = ZoneEditor(self.canvas, self.pipeline.zones, on_change=self.pipeline.set_zones)
         
-        # Start the motion detection
-        self.detect_motion()
+        # Create a hidden text item for the stats overlay
+        self.hud = self.canvas.create_text(8, 8, text="", anchor=tk.NW, fill="yellow", font=("Courier", 9), state=tk.HIDDEN)
+        self.hud_visible = False
+
+        # Create buttons to edit the detection zones
+        zone_frame = tk.Frame(self.root)
+        zone_frame.pack(pady=5)
+        tk.Button(zone_frame, text="Include Zone", command=lambda: self.zone_editor.start(INCLUDE)).pack(side=tk.LEFT, padx=2)
+        tk.Button(zone_frame, text="Exclude Zone", command=lambda: self.zone_editor.start(EXCLUDE)).pack(side=tk.LEFT, padx=2)
+        tk.Button(zone_frame, text="Clear Zones", command=self.zone_editor.clear).pack(side=tk.LEFT, padx=2)
+        tk.Button(zone_frame, text="Save Zones", command=self.zone_editor.stop).pack(side=tk.LEFT, padx=2)
+        tk.Button(zone_frame, text="Stats", command=self.toggle_hud).pack(side=tk.LEFT, padx=2)
+
+        # Show the address of the browser stream for this session, the token stops working on logout
+        server = self.pipeline.stream_server
+        if server is not None:
+            host = "127.0.0.1" if server.host in ("", "0.0.0.0") else server.host
+            address = tk.StringVar(value="http://%s:%d/?token=%s" % (host, server.port, app.session))
+            tk.Entry(self.root, textvariable=address, state="readonly", width=60).pack(pady=2)
 
         # Create a button to logout
         logout_button = tk.Button(self.root, text="Logout", command=self.logout)
         logout_button.pack(pady=5)
-                
-        self.root.mainloop()
+        
+        # Start receiving frames from the pipeline
+        self.pipeline.view = self
     
-    def detect_motion(self):
-        # Read a frame from the video source
-        ret, frame = self.video.read()
+    def show_frame(self, frame, detect, render):
+        # Called by the pipeline for every frame, returns True when the frame was drawn
+        pipeline = self.pipeline
+        if detect:
+            # Move the overlay rectangles and labels to the tracked objects
+            self.overlays.update([track.box for track in pipeline.tracks], ["Motion #%d" % track.id for track in pipeline.tracks])
         
-        if ret:
-            # Convert the frame to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Blur the frame to reduce noise
-            gray = cv2.GaussianBlur(gray, (21, 21), 0)
-            
-            if self.prev_frame is None:
-                # Set the previous frame for the first iteration
-                self.prev_frame = gray
-            else:
-                # Compute the absolute difference between the current and previous frame
-                frame_delta = cv2.absdiff(self.prev_frame, gray)
-                
-                # Threshold the delta image to highlight regions with significant changes
-                thresh = cv2.threshold(frame_delta, 30, 255, cv2.THRESH_BINARY)[1]
-                
-                # Apply image dilation to fill in the holes
-                thresh = cv2.dilate(thresh, None, iterations=2)
-                
-                # Find contours of the threshold image
-                contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                # Create a dictionary to store the active motion regions
-                active_motion_regions = {}
-                
-                # Process the contours
-                for contour in contours:
-                    if cv2.contourArea(contour) > 500:
-                        # Draw a rectangle around the contour
-                        (x, y, w, h) = cv2.boundingRect(contour)
-                        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                        
-                        # Add the motion region to the active motion regions dictionary
-                        active_motion_regions[(x, y, w, h)] = True
-                        
-                        # Check if a label already exists for this motion region
-                        if (x, y, w, h) not in self.motion_labels:
-                            # Create a new label for this motion region
-                            label_text = "Motion Detected!"
-                            label = tk.Label(self.root, text=label_text, fg='red')
-                            label.place(x=x, y=y - 20)
-                            self.motion_labels[(x, y, w, h)] = label
-                            
-                # Remove labels for inactive motion regions
-                inactive_motion_regions = set(self.motion_labels.keys()) - set(active_motion_regions.keys())
-                for region in inactive_motion_regions:
-                    label = self.motion_labels[region]
-                    label.destroy()
-                    del self.motion_labels[region]
-            
-                # Convert the OpenCV image to PIL format
-                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                image = Image.fromarray(image)
-                image = ImageTk.PhotoImage(image)
-                
-                # Clear the canvas before updating with the new image
-                self.canvas.delete("all")
-                
-                # Update the canvas with the new image
-                self.canvas.create_image(0, 0, anchor=tk.NW, image=image)
-                self.canvas.image = image
-                
-                # Update the previous frame
-                self.prev_frame = gray
+        # Update the canvas with the new frame, skipped while the window is hidden
+        rendered = render and self.display.show(frame)
+        if rendered:
+            self.app.first_frame()
         
-        # Schedule the next motion detection iteration
-        self.root.after(10, self.detect_motion)
+        if pipeline.metrics_enabled:
+            if rendered:
+                pipeline.metrics.observe("render", self.display.last_render_ms / 1000.0)
+            if self.hud_visible and pipeline.pacer.frame_number % 15 == 0:
+                self.canvas.itemconfigure(self.hud, text=pipeline.metrics.summary())
+        if pipeline.pacer.frame_number % 30 == 0:
+            self.status_label.config(text="Detect: %.1f fps, Render: %.1f fps (%.1f ms/frame)%s" % (
+                pipeline.pacer.detect_fps, pipeline.pacer.render_fps, self.display.render_ms,
+                ", overloaded" if pipeline.pacer.overloaded() else ""))
+        return rendered
+
+    def refresh_events(self):
+        # Show the thumbnails of the newest events every few seconds. They come from the snapshot store's
+        # cache, and the Tk images are only made for thumbnails that weren't on screen before.
+        from PIL import Image, ImageTk
+
+        snapshots = self.pipeline.snapshots
+        photos = {}
+        rows = snapshots.recent(self.pipeline.camera, RECENT_EVENTS)
+        for label, row in zip(self.event_labels, rows):
+            path = row["thumbnail"]
+            photo = self.event_photos.get(path)
+            if photo is None:
+                entry = snapshots.thumbnail(path)
+                if entry is None:
+                    continue
+                photo = ImageTk.PhotoImage(Image.fromarray(entry[1][:, :, ::-1]))
+            photos[path] = photo
+            label.config(image=photo, text=time.strftime("%H:%M:%S", time.localtime(row["ts"])))
+
+        # Tk images are freed as soon as nothing refers to them, keep the ones on screen
+        self.event_photos = photos
+        self.events_job = self.app.root.after(2000, self.refresh_events)
+
+    def toggle_hud(self):
+        # Show or hide the per-stage timings on top of the video
+        self.hud_visible = not self.hud_visible
+        if self.hud_visible:
+            self.pipeline.enable_metrics()
+            self.canvas.tag_raise(self.hud)
+        self.canvas.itemconfigure(self.hud, state=tk.NORMAL if self.hud_visible else tk.HIDDEN)
 
     def logout(self):
-        # Release the video source and destroy the root window
-        self.video.release()
-        self.root.destroy()
-        
-        # Create an instance of the HomePage class
-        homepage = HomePage()
-
-    def __del__(self):
-        # Release the video source and destroy the root window
-        self.video.release()
-        self.root.destroy()
-
-# Create an instance of the HomePage class
-homepage = HomePage()
+        # End the session and go back to the homepage, the camera keeps running in the background
+        self.app.credentials.logout(self.app.session)
+        self.app.session = None
+        self.app.show(HomePage)
+
+    def close(self):
+        # Stop drawing frames before the canvas goes away
+        if self.pipeline is not None and self.pipeline.view is self:
+            self.pipeline.view = None
+        if self.events_job is not None:
+            self.app.root.after_cancel(self.events_job)
+        Screen.close(self)
+
+if __name__ == "__main__":
+    # Create the application window and show the homepage
+    app = HomeSecurityApp()
+    app.run()
@@ -0,0 +1,288 @@
+# Background models used by MotionDetector to decide which pixels changed.
+# Compare their cost on a recording with: python -m background clip.mp4
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from buffers import FrameBuffers
+
+
+class BackgroundModel:
+    # Number of frames the model needs before its mask can be trusted
+    warmup_frames = 1
+
+    # Models whose result for a pixel only depends on that pixel can be computed band by band on several threads
+    supports_bands = False
+
+    def __init__(self):
+        self.frame_count = 0
+        self.total_time = 0.0
+
+        # Frames the detector skipped since the last update, models that learn over time weigh the
+        # next frame as if they had seen it that many more times
+        self.skipped_frames = 0
+
+        # Output buffers reused from frame to frame
+        self.buffers = FrameBuffers()
+
+        # Optional metrics.StageTimer set by the detector
+        self.timer = None
+
+    def apply(self, gray, pool=None):
+        # Return a binary mask of the pixels that differ from the background,
+        # or None while the model is still warming up. With a bands.BandPool the
+        # work is split into horizontal bands when the model supports it.
+        start = time.perf_counter()
+        if pool is not None and self.supports_bands:
+            mask = self.compute_bands(gray, pool)
+        else:
+            mask = self.compute(gray)
+        self.total_time += time.perf_counter() - start
+        self.frame_count += 1
+        if self.frame_count <= self.warmup_frames:
+            return None
+        return mask
+
+    def skip(self):
+        # Called for every frame the change gate kept from the model
+        self.skipped_frames += 1
+
+    def learning_rate(self, rate):
+        # Per-frame learning rate made up for the skipped frames: learning at rate from the same frame
+        # k + 1 times leaves 1 - (1 - rate) ** (k + 1) of it in the model
+        rate = 1.0 - (1.0 - rate) ** (self.skipped_frames + 1)
+        self.skipped_frames = 0
+        return rate
+
+    def compute(self, gray):
+        raise NotImplementedError
+
+    def compute_bands(self, gray, pool):
+        raise NotImplementedError
+
+    def reset(self):
+        self.frame_count = 0
+        self.total_time = 0.0
+        self.skipped_frames = 0
+
+    def average_ms(self):
+        # Average cost per frame in milliseconds
+        if self.frame_count == 0:
+            return 0.0
+        return self.total_time / self.frame_count * 1000.0
+
+
+class PrevFrameModel(BackgroundModel):
+    # The original behaviour: difference against the previous frame only
+    supports_bands = True
+
+    def __init__(self, delta_threshold=30):
+        super().__init__()
+        self.delta_threshold = delta_threshold
+        self.prev_frame = None
+
+    def compute(self, gray):
+        # The caller double-buffers its gray frames, so keeping a reference to the
+        # previous one is safe until the frame after next
+        if self.prev_frame is None or self.prev_frame.shape != gray.shape:
+            self.prev_frame = gray
+            return None
+
+        # Compute the absolute difference between the current and previous frame
+        frame_delta = self.buffers.get("delta", gray.shape)
+        self.buffers.keep("delta", cv2.absdiff(self.prev_frame, gray, dst=frame_delta))
+        if self.timer:
+            self.timer.mark("diff")
+
+        # Threshold the delta image to highlight regions with significant changes
+        mask = self.buffers.get("mask", gray.shape)
+        mask = self.buffers.keep("mask", cv2.threshold(frame_delta, self.delta_threshold, 255, cv2.THRESH_BINARY, dst=mask)[1])
+        if self.timer:
+            self.timer.mark("threshold")
+
+        # Update the previous frame
+        self.prev_frame = gray
+        return mask
+
+    def compute_bands(self, gray, pool):
+        # Same as compute(), each thread writes its own rows of the shared delta and mask buffers
+        if self.prev_frame is None or self.prev_frame.shape != gray.shape:
+            self.prev_frame = gray
+            return None
+        prev_frame = self.prev_frame
+        frame_delta = self.buffers.get("delta", gray.shape)
+        mask = self.buffers.get("mask", gray.shape)
+
+        def band(first, end):
+            cv2.absdiff(prev_frame[first:end], gray[first:end], dst=frame_delta[first:end])
+            cv2.threshold(frame_delta[first:end], self.delta_threshold, 255, cv2.THRESH_BINARY, dst=mask[first:end])
+
+        pool.run(band)
+        if self.timer:
+            self.timer.mark("diff")
+        self.prev_frame = gray
+        return mask
+
+    def reset(self):
+        super().reset()
+        self.prev_frame = None
+
+
+class RunningAverageModel(BackgroundModel):
+    # Exponential running average of past frames, slow movers stand out against it
+    supports_bands = True
+
+    def __init__(self, delta_threshold=30, alpha=0.05):
+        super().__init__()
+        self.delta_threshold = delta_threshold
+        self.alpha = alpha
+        self.average = None
+
+    def compute(self, gray):
+        if self.average is None or self.average.shape != gray.shape:
+            # Allocate the float accumulator once per resolution
+            self.average = self.buffers.get("average", gray.shape, np.float32)
+            self.average[...] = gray
+            return None
+
+        # Compare against the background learned so far, then fold the frame into it
+        background = self.buffers.get("background", gray.shape)
+        self.buffers.keep("background", cv2.convertScaleAbs(self.average, dst=background))
+        frame_delta = self.buffers.get("delta", gray.shape)
+        self.buffers.keep("delta", cv2.absdiff(background, gray, dst=frame_delta))
+        cv2.accumulateWeighted(gray, self.average, self.learning_rate(self.alpha))
+        if self.timer:
+            self.timer.mark("diff")
+
+        # Threshold the delta image to highlight regions with significant changes
+        mask = self.buffers.get("mask", gray.shape)
+        mask = self.buffers.keep("mask", cv2.threshold(frame_delta, self.delta_threshold, 255, cv2.THRESH_BINARY, dst=mask)[1])
+        if self.timer:
+            self.timer.mark("threshold")
+        return mask
+
+    def compute_bands(self, gray, pool):
+        # Same as compute(), each thread updates its own rows of the accumulator
+        if self.average is None or self.average.shape != gray.shape:
+            self.average = self.buffers.get("average", gray.shape, np.float32)
+            self.average[...] = gray
+            return None
+        average = self.average
+        alpha = self.learning_rate(self.alpha)
+        background = self.buffers.get("background", gray.shape)
+        frame_delta = self.buffers.get("delta", gray.shape)
+        mask = self.buffers.get("mask", gray.shape)
+
+        def band(first, end):
+            cv2.convertScaleAbs(average[first:end], dst=background[first:end])
+            cv2.absdiff(background[first:end], gray[first:end], dst=frame_delta[first:end])
+            cv2.accumulateWeighted(gray[first:end], average[first:end], alpha)
+            cv2.threshold(frame_delta[first:end], self.delta_threshold, 255, cv2.THRESH_BINARY, dst=mask[first:end])
+
+        pool.run(band)
+        if self.timer:
+            self.timer.mark("diff")
+        return mask
+
+    def reset(self):
+        super().reset()
+        self.average = None
+
+
+class SubtractorModel(BackgroundModel):
+    # Base for the OpenCV background subtractors, subclasses create the subtractor in reset()
+    def __init__(self, history=500):
+        super().__init__()
+        self.history = history
+        self.subtractor = None
+
+    def compute(self, gray):
+        mask = self.buffers.get("mask", gray.shape)
+        # -1 lets OpenCV pick the rate from the history, after skipped frames it is made up for explicitly
+        rate = self.learning_rate(1.0 / min(self.history, self.frame_count + 1)) if self.skipped_frames else -1
+        mask = self.buffers.keep("mask", self.subtractor.apply(gray, mask, rate))
+        if self.timer:
+            self.timer.mark("subtractor")
+        return mask
+
+
+class MOG2Model(SubtractorModel):
+    # OpenCV's Gaussian mixture background subtractor
+    warmup_frames = 2
+
+    def __init__(self, history=500, var_threshold=16):
+        super().__init__(history)
+        self.var_threshold = var_threshold
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(
+            history=self.history, varThreshold=self.var_threshold, detectShadows=False
+        )
+
+
+class KNNModel(SubtractorModel):
+    # OpenCV's k-nearest-neighbours background subtractor
+    warmup_frames = 5
+
+    def __init__(self, history=500, dist2_threshold=400.0):
+        super().__init__(history)
+        self.dist2_threshold = dist2_threshold
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.subtractor = cv2.createBackgroundSubtractorKNN(
+            history=self.history, dist2Threshold=self.dist2_threshold, detectShadows=False
+        )
+
+
+BACKGROUND_MODELS = {
+    "prev": PrevFrameModel,
+    "average": RunningAverageModel,
+    "mog2": MOG2Model,
+    "knn": KNNModel,
+}
+
+
+def create_background_model(mode, delta_threshold=30):
+    # Build one of the supported background models by name
+    if mode not in BACKGROUND_MODELS:
+        raise ValueError("unknown background model %r, expected one of %s" % (mode, ", ".join(BACKGROUND_MODELS)))
+    if mode in ("prev", "average"):
+        return BACKGROUND_MODELS[mode](delta_threshold=delta_threshold)
+    return BACKGROUND_MODELS[mode]()
+
+
+def main(argv=None):
+    from detector import MotionDetector
+
+    parser = argparse.ArgumentParser(description="Compare the cost and trigger rate of the background models on a video.")
+    parser.add_argument("source", help="video file to run the models on")
+    parser.add_argument("--scale", type=float, default=1.0, help="detection scale")
+    parser.add_argument("--max-frames", type=int, default=0, help="stop after this many frames (0 reads the whole file)")
+    args = parser.parse_args(argv)
+
+    print("%-8s %10s %10s %10s" % ("model", "ms/frame", "frames", "triggers"))
+    for mode in BACKGROUND_MODELS:
+        # Without the change gate every model sees every frame, so the costs and triggers compare like for like
+        detector = MotionDetector(scale=args.scale, background=mode, gate=False)
+        video = cv2.VideoCapture(args.source)
+        frames = 0
+        triggers = 0
+        while not args.max_frames or frames < args.max_frames:
+            ret, frame = video.read()
+            if not ret:
+                break
+            frames += 1
+            if detector.detect(frame):
+                triggers += 1
+        video.release()
+        print("%-8s %10.2f %10d %10d" % (mode, detector.background.average_ms(), frames, triggers))
+
+
+if __name__ == "__main__":
+    main()
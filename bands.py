@@ -0,0 +1,41 @@
+import concurrent.futures
+
+
+def band_rows(height, count):
+    # Split the rows of a frame into count horizontal bands of about the same height, as (first, end) pairs
+    count = max(1, min(count, height))
+    edges = [height * index // count for index in range(count + 1)]
+    return [(edges[index], edges[index + 1]) for index in range(count)]
+
+
+class BandPool:
+    def __init__(self, threads, bands_per_thread=2):
+        # Per-pixel stages are run band by band on these threads, OpenCV releases the GIL while it works.
+        # A few more bands than threads keeps every thread busy when some bands take longer.
+        self.threads = threads
+        self.bands_per_thread = bands_per_thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.height = None
+        self.bands = []
+
+    def split(self, height):
+        # The band layout only changes with the frame height
+        if height != self.height:
+            self.height = height
+            self.bands = band_rows(height, self.threads * self.bands_per_thread)
+        return self.bands
+
+    def run(self, function):
+        # Call function(first, end) for every band and wait for all of them, so the next
+        # stage can read rows from neighbouring bands
+        futures = [self.executor.submit(function, first, end) for (first, end) in self.bands]
+        for future in futures:
+            future.result()
+
+    def halo(self, first, end, margin):
+        # Rows first - margin to end + margin, clipped to the frame. A filter that reads up to margin
+        # rows away gives the same result on the rows first to end as it would on the whole frame.
+        return max(0, first - margin), min(self.height, end + margin)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
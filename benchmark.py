@@ -0,0 +1,329 @@
+# Headless benchmark of the detection and render pipeline.
+#   python -m benchmark --output results.json
+#   python -m benchmark --compare baseline.json
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from detector import EXTRACTION_MODES, MotionDetector
+from metrics import StageTimer
+
+RESOLUTIONS = {
+    "480p": (640, 480),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+SCENES = ("shapes", "noise", "lighting")
+
+# Stages that ran on fewer frames, or got slower by less than this, are not flagged as regressions
+MIN_STAGE_FRAMES = 30
+MIN_STAGE_SLOWDOWN_MS = 0.05
+
+# p99 of fewer frames comes down to the one or two slowest frames of the run, which is luck on a busy machine
+MIN_P99_FRAMES = 500
+
+
+class SyntheticVideo:
+    def __init__(self, scene, width, height, frames, seed=0):
+        # Frames are generated one at a time so 4K runs don't need gigabytes of memory
+        self.scene = scene
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.rng = np.random.default_rng(seed)
+
+        # A fixed textured background, the same for every frame
+        background = self.rng.integers(0, 255, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+        self.background = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+        self.noise = np.empty((height, width, 3), dtype=np.uint8)
+
+    def __iter__(self):
+        for index in range(self.frames):
+            yield self.frame(index)
+
+    def frame(self, index):
+        frame = self.background.copy()
+
+        # Every scene has a little sensor noise
+        cv2.randu(self.noise, 0, 6)
+        cv2.add(frame, self.noise, dst=frame)
+
+        if self.scene == "lighting":
+            # Slow brightness swings, like clouds or lights on a dimmer
+            gain = 1.0 + 0.3 * np.sin(index / 15.0)
+            cv2.convertScaleAbs(frame, dst=frame, alpha=gain)
+
+        if self.scene in ("shapes", "lighting"):
+            # A few shapes crossing the frame at different speeds
+            unit = max(4, self.width // 40)
+            for number in range(3):
+                x = int((index * unit * (number + 1) / 4) % self.width)
+                y = int(self.height * (number + 1) / 4)
+                if number % 2:
+                    cv2.circle(frame, (x, y), unit * 2, (40, 220, 40), -1)
+                else:
+                    cv2.rectangle(frame, (x, y - unit * 2), (x + unit * 3, y + unit * 2), (230, 230, 230), -1)
+        return frame
+
+
+def read_clip(path, max_frames):
+    video = cv2.VideoCapture(path)
+    count = 0
+    try:
+        while not max_frames or count < max_frames:
+            ret, frame = video.read()
+            if not ret:
+                break
+            count += 1
+            yield frame
+    finally:
+        video.release()
+
+
+def render_conversion():
+    # The same conversion CanvasDisplay does before handing the frame to Tk, minus Tk itself
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    buffers = {}
+
+    def convert(frame):
+        rgb = buffers.get(frame.shape)
+        if rgb is None:
+            rgb = buffers[frame.shape] = np.empty(frame.shape, dtype=np.uint8)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        return Image.frombuffer("RGB", (frame.shape[1], frame.shape[0]), rgb, "raw", "RGB", 0, 1)
+
+    return convert
+
+
+def peak_rss_mb():
+    # Peak memory of this process, every case runs in a process of its own so this is the case's peak.
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def run_case(name, frames, detector_options, warmup=5):
+    detector = MotionDetector(**detector_options)
+    timer = StageTimer()
+    convert = render_conversion()
+
+    latencies = []
+    render = []
+    allocations = 0
+    processed = 0
+    elapsed = 0.0
+    for index, frame in enumerate(frames):
+        if index == warmup:
+            # Ignore the first frames, they allocate buffers and fill the background model
+            timer.reset()
+            latencies = []
+            render = []
+        detector.set_timer(timer if index >= warmup else None)
+
+        start = time.perf_counter()
+        detector.detect(frame)
+        if convert is not None:
+            render_start = time.perf_counter()
+            convert(frame)
+            render.append(time.perf_counter() - render_start)
+        latency = time.perf_counter() - start
+
+        if index >= warmup:
+            # Buffers allocated after the warm-up, a steady-state loop allocates none
+            allocations += detector.frame_allocations
+            latencies.append(latency)
+            elapsed += latency
+            processed += 1
+
+    stages = {}
+    for stage, samples in timer.samples.items():
+        stages[stage] = summarize(samples)
+    if render:
+        stages["render_conversion"] = summarize(render)
+
+    return {
+        "name": name,
+        "frames": processed,
+        "fps": processed / elapsed if elapsed else 0.0,
+        "latency_p50_ms": percentile_ms(latencies, 50),
+        "latency_p99_ms": percentile_ms(latencies, 99),
+        "stages": stages,
+        "steady_allocations": allocations,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure_case(source, detector_options, threads):
+    # Runs in a fresh worker process per case, so the peak memory isn't left over from an earlier, larger case
+    if threads is not None:
+        cv2.setNumThreads(threads)
+    if source[0] == "clip":
+        _, path, frames = source
+        return run_case("clip/%s" % path, read_clip(path, frames), detector_options)
+    _, scene, resolution, frames = source
+    width, height = RESOLUTIONS[resolution]
+    return run_case("%s/%s" % (scene, resolution), SyntheticVideo(scene, width, height, frames), detector_options)
+
+
+def best_of(runs):
+    # Combine repeated runs of a case into their best result. Noise from other processes and the scheduler
+    # only ever makes a run slower, so the best of a few runs is what the code itself can do.
+    case = dict(runs[0])
+    case["runs"] = len(runs)
+    case["fps"] = max(run["fps"] for run in runs)
+    case["latency_p50_ms"] = min(run["latency_p50_ms"] for run in runs)
+    case["latency_p99_ms"] = min(run["latency_p99_ms"] for run in runs)
+    case["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+    case["steady_allocations"] = max(run["steady_allocations"] for run in runs)
+    case["stages"] = {}
+    for stage in runs[0]["stages"]:
+        timings = [run["stages"][stage] for run in runs if stage in run["stages"]]
+        case["stages"][stage] = {
+            "mean_ms": min(timing["mean_ms"] for timing in timings),
+            "p50_ms": min(timing["p50_ms"] for timing in timings),
+            "p99_ms": min(timing["p99_ms"] for timing in timings),
+            "frames": timings[0]["frames"],
+        }
+    return case
+
+
+def summarize(samples):
+    # Mean, p50 and p99 over the frames that ran the stage, and how many of the measured frames did
+    return {
+        "mean_ms": float(np.mean(samples)) * 1000.0 if samples else 0.0,
+        "p50_ms": percentile_ms(samples, 50),
+        "p99_ms": percentile_ms(samples, 99),
+        "frames": len(samples),
+    }
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000.0 if samples else 0.0
+
+
+def compare(results, baseline, tolerance, p99_tolerance):
+    # Report every case that got slower than the baseline by more than the tolerance
+    regressions = []
+    previous = {case["name"]: case for case in baseline["cases"]}
+    for case in results["cases"]:
+        if case["name"] in previous:
+            regressions += compare_case(case, previous[case["name"]], tolerance, p99_tolerance)
+    return regressions
+
+
+def compare_case(case, old, tolerance, p99_tolerance):
+    # p99 rests on the slowest few frames of each run and moves more between identical runs, so it has a tolerance
+    # of its own and is only compared with enough frames
+    regressions = []
+    if case["fps"] < old["fps"] * (1.0 - tolerance):
+        regressions.append("%s: fps %.1f -> %.1f" % (case["name"], old["fps"], case["fps"]))
+    if case["frames"] >= MIN_P99_FRAMES and case["latency_p99_ms"] > old["latency_p99_ms"] * (1.0 + p99_tolerance):
+        regressions.append("%s: p99 latency %.2f -> %.2f ms" % (case["name"], old["latency_p99_ms"], case["latency_p99_ms"]))
+    if case["steady_allocations"] > old.get("steady_allocations", 0):
+        regressions.append("%s: %d buffers allocated after warm-up" % (case["name"], case["steady_allocations"]))
+    for stage, timing in case["stages"].items():
+        old_timing = old["stages"].get(stage)
+        # Stages are compared on their median, and only when they ran on enough frames and got slower
+        # by more than the timer's jitter, a stage that only runs now and then can't be timed reliably
+        if not old_timing or "p50_ms" not in old_timing or timing["frames"] < MIN_STAGE_FRAMES:
+            continue
+        old_ms, new_ms = old_timing["p50_ms"], timing["p50_ms"]
+        if new_ms > old_ms * (1.0 + tolerance) and new_ms - old_ms > MIN_STAGE_SLOWDOWN_MS:
+            regressions.append("%s: %s %.2f -> %.2f ms" % (case["name"], stage, old_ms, new_ms))
+    return regressions
+
+
+def measure_runs(source, detector_options, threads, count):
+    runs = []
+    for _ in range(max(1, count)):
+        with multiprocessing.Pool(1) as pool:
+            runs.append(pool.apply(measure_case, (source, detector_options, threads)))
+    return runs
+
+
+def print_case(case):
+    print("%-22s %8.1f fps  p50 %7.2f ms  p99 %7.2f ms  rss %7.1f MB  allocs %d" % (
+        case["name"], case["fps"], case["latency_p50_ms"], case["latency_p99_ms"], case["peak_rss_mb"], case["steady_allocations"]))
+    for stage, timing in case["stages"].items():
+        print("    %-18s %7.2f ms  (%d frames)" % (stage, timing["mean_ms"], timing["frames"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the motion detection pipeline without a GUI.")
+    parser.add_argument("--resolutions", nargs="+", choices=sorted(RESOLUTIONS), default=["480p", "1080p", "4k"])
+    parser.add_argument("--scenes", nargs="+", choices=SCENES, default=list(SCENES))
+    parser.add_argument("--clips", nargs="*", default=[], help="recorded video files to benchmark as well")
+    parser.add_argument("--frames", type=int, default=120, help="frames per case")
+    parser.add_argument("--repeat", type=int, default=3, help="run every case this many times and keep the best result")
+    parser.add_argument("--scale", type=float, default=1.0, help="detection scale")
+    parser.add_argument("--background", default="prev", help="background model")
+    parser.add_argument("--no-gate", action="store_true", help="disable the change gate")
+    parser.add_argument("--threads", type=int, default=None, help="OpenCV thread count (default: OpenCV's choice)")
+    parser.add_argument("--band-threads", type=int, default=1, help="run the per-pixel stages in bands on this many threads")
+    parser.add_argument("--extraction", choices=EXTRACTION_MODES, default="contours", help="region extraction mode")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, metavar="BASELINE", help="compare against a stored results file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before a regression is flagged")
+    parser.add_argument("--p99-tolerance", type=float, default=0.30, help="allowed p99 latency increase before a regression is flagged")
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    detector_options = {"scale": args.scale, "background": args.background, "gate": not args.no_gate, "threads": args.band_threads,
+                        "extraction": args.extraction}
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "options": dict(detector_options, frames=args.frames, repeat=args.repeat, threads=cv2.getNumThreads()),
+        "cases": [],
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        previous = {case["name"]: case for case in baseline["cases"]}
+
+    sources = [("synthetic", scene, resolution, args.frames) for resolution in args.resolutions for scene in args.scenes]
+    sources += [("clip", path, args.frames) for path in args.clips]
+    for source in sources:
+        runs = measure_runs(source, detector_options, args.threads, args.repeat)
+        case = best_of(runs)
+        old = previous.get(case["name"]) if baseline is not None else None
+        if old is not None and compare_case(case, old, args.tolerance, args.p99_tolerance):
+            # A slow run on a busy machine looks like a regression, measure the case again before reporting it
+            runs += measure_runs(source, detector_options, args.threads, args.repeat)
+            case = best_of(runs)
+        results["cases"].append(case)
+        print_case(case)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.p99_tolerance)
+        if regressions:
+            print("\nRegressions against %s:" % args.compare)
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("\nNo regressions against %s" % args.compare)
+
+
+if __name__ == "__main__":
+    main()
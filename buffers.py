@@ -0,0 +1,27 @@
+import numpy as np
+
+
+class FrameBuffers:
+    def __init__(self):
+        # Named image buffers, allocated once per resolution and reused for every frame
+        self.buffers = {}
+
+        # Number of arrays allocated so far, should stop growing once the resolution is stable
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        # Return the buffer with this name, allocating it only when the shape or type changed
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buffer
+            self.allocations += 1
+        return buffer
+
+    def keep(self, name, result):
+        # Record the output of an OpenCV call that was given a dst= buffer.
+        # If OpenCV had to allocate a new array instead, count it and reuse that one next time.
+        if result is not self.buffers.get(name):
+            self.buffers[name] = result
+            self.allocations += 1
+        return result
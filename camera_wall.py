@@ -0,0 +1,44 @@
+import io
+import tkinter as tk
+
+from PIL import Image, ImageTk
+
+from supervisor import log_message
+
+
+class CameraWall:
+    def __init__(self, supervisor, columns=4):
+        self.supervisor = supervisor
+        self.supervisor.on_message = self.on_message
+
+        self.root = tk.Tk()
+        self.root.title("Home Security - Cameras")
+
+        # Create one thumbnail label per camera laid out in a grid
+        self.labels = {}
+        for index, camera in enumerate(supervisor.workers):
+            label = tk.Label(self.root, text="Camera %s" % camera, compound=tk.TOP)
+            label.grid(row=index // columns, column=index % columns, padx=2, pady=2)
+            self.labels[camera] = label
+
+    def on_message(self, kind, camera, payload):
+        if kind == "thumbnail" and payload:
+            # Decode the JPEG thumbnail and show it in the camera's cell
+            image = ImageTk.PhotoImage(Image.open(io.BytesIO(payload)))
+            label = self.labels[camera]
+            label.configure(image=image)
+            label.image = image
+        log_message(kind, camera, payload)
+
+    def poll(self):
+        # Handle worker messages without blocking the Tk loop
+        self.supervisor.poll()
+        self.root.after(50, self.poll)
+
+    def run(self):
+        self.supervisor.start()
+        self.poll()
+        try:
+            self.root.mainloop()
+        finally:
+            self.supervisor.stop()
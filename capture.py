@@ -0,0 +1,260 @@
+# Threaded frame capture for camera devices, network streams (RTSP, HTTP MJPEG) and files.
+# Check a stream with: python -m capture rtsp://camera/stream
+import argparse
+import os
+import threading
+import urllib.parse
+import time
+from collections import deque
+
+import cv2
+
+STREAM_PREFIXES = ("rtsp://", "rtsps://", "http://", "https://", "rtmp://", "udp://", "tcp://")
+
+# Ask FFmpeg for as little buffering as possible, unless the user set their own options
+LOW_LATENCY_OPTIONS = "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay|max_delay;500000"
+
+
+def is_stream(source):
+    return isinstance(source, str) and source.lower().startswith(STREAM_PREFIXES)
+
+
+def open_capture(source, timeout=5.0):
+    # Open a source with short connect and read timeouts and a minimal decoder buffer
+    if is_stream(source):
+        os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", LOW_LATENCY_OPTIONS)
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000), cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(timeout * 1000)]
+        video = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+    else:
+        video = cv2.VideoCapture(source)
+    # Not every backend honours this, those that do hand out the newest frame instead of a queued one
+    video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return video
+
+
+class FrameGrabber:
+    def __init__(self, video_source=0, buffer_size=2, stall_timeout=5.0, min_backoff=0.5, max_backoff=30.0, loop=False):
+        # Open the video source
+        self.source = video_source
+        self.stall_timeout = stall_timeout
+        self.video = open_capture(video_source, stall_timeout)
+
+        # Files stand in for cameras: they are played at their own frame rate, and from the start again when loop is set
+        self.is_file = isinstance(video_source, str) and os.path.isfile(video_source)
+        self.loop = loop
+
+        # Reconnect after a failure or a stall, waiting longer after each failed attempt
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.reconnect_count = 0
+        self.stall_count = 0
+        self.connected = self.video.isOpened()
+        self.last_frame_time = time.monotonic()
+
+        # Keep only the most recent frames, the oldest one is dropped when the consumer falls behind
+        self.frames = deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+
+        # Count frames read from the source and frames dropped from the buffer
+        self.frame_count = 0
+        self.dropped_count = 0
+
+        # Smoothed time between a frame arriving from the source and the consumer picking it up
+        self.latency = 0.0
+
+        # Optional metrics.PipelineMetrics that times each camera read
+        self.metrics = None
+
+        self.running = False
+        self.stopping = threading.Event()
+        self.thread = None
+
+        # While the capture thread runs it owns the video source. A read from a stalled stream can block
+        # for the whole read timeout, so release() leaves closing the source to the thread when it is
+        # still inside one, closing it under a running read would crash the FFmpeg backend.
+        self.capturing = False
+        self.closing = False
+
+    def get(self, prop):
+        # Forward property lookups (width, height, fps) to the video source
+        return self.video.get(prop)
+
+    def start(self):
+        # Start the capture thread
+        if self.running:
+            return self
+        self.running = True
+        self.capturing = True
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def capture_loop(self):
+        try:
+            self.read_loop()
+        finally:
+            with self.lock:
+                self.capturing = False
+                if self.closing:
+                    self.video.release()
+
+    def read_loop(self):
+        fps = self.video.get(cv2.CAP_PROP_FPS)
+        frame_interval = 1.0 / fps if self.is_file and 0 < fps < 240 else 0.0
+        next_frame = time.monotonic()
+        while self.running:
+            # Read a frame from the video source outside of the lock
+            if self.metrics is not None:
+                start = time.perf_counter()
+                ret, frame = self.video.read()
+                self.metrics.observe("capture", time.perf_counter() - start)
+            else:
+                ret, frame = self.video.read()
+            now = time.monotonic()
+
+            if not ret:
+                if self.is_file and self.frame_count:
+                    if not self.loop:
+                        # End of the file
+                        self.connected = False
+                        break
+                    # End of the stand-in file, play it again
+                    self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                if not self.video.isOpened() or now - self.last_frame_time >= self.stall_timeout:
+                    # The source is gone or has stopped sending frames
+                    if self.connected:
+                        self.stall_count += 1
+                    self.reconnect()
+                else:
+                    # Avoid spinning on a source that has no frame ready
+                    self.stopping.wait(0.01)
+                continue
+
+            self.last_frame_time = now
+            self.connected = True
+            self.backoff = self.min_backoff
+
+            with self.lock:
+                if len(self.frames) == self.frames.maxlen:
+                    self.dropped_count += 1
+                self.frames.append((now, frame))
+                self.frame_count += 1
+                self.new_frame.notify_all()
+
+            if frame_interval:
+                # Play files at their own frame rate like a live camera would
+                next_frame = max(next_frame + frame_interval, now - frame_interval)
+                self.stopping.wait(next_frame - time.monotonic())
+
+    def reconnect(self):
+        # Close the source, wait out the backoff and open it again
+        self.connected = False
+        self.video.release()
+        if self.stopping.wait(self.backoff):
+            return
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        self.video = open_capture(self.source, self.stall_timeout)
+        self.reconnect_count += 1
+        # Give the new connection a full stall timeout to deliver its first frame
+        self.last_frame_time = time.monotonic()
+
+    def read(self, timeout=None):
+        # Return the freshest frame and discard anything older, like cv2.VideoCapture.read()
+        ret, frame, _ = self.read_with_timestamp(timeout)
+        return ret, frame
+
+    def read_with_timestamp(self, timeout=None):
+        # Same as read() but also returns the capture time of the frame
+        with self.lock:
+            if not self.frames and timeout:
+                self.new_frame.wait(timeout)
+            if not self.frames:
+                return False, None, None
+            timestamp, frame = self.frames.pop()
+            self.dropped_count += len(self.frames)
+            self.frames.clear()
+        self.latency += 0.1 * (time.monotonic() - timestamp - self.latency)
+        return True, frame, timestamp
+
+    def metric_values(self):
+        # Counters for metrics.PipelineMetrics.add_collector()
+        return {
+            "frames_captured_total": ("counter", "Frames read from the camera.", self.frame_count),
+            "frames_dropped_total": ("counter", "Frames replaced by a newer one before they were used.", self.dropped_count),
+            "capture_queue_depth": ("gauge", "Frames waiting in the capture buffer.", len(self.frames)),
+            "stream_connected": ("gauge", "1 while the source is delivering frames.", int(self.connected)),
+            "stream_reconnects_total": ("counter", "Times the source was reopened.", self.reconnect_count),
+            "stream_stalls_total": ("counter", "Times the source stopped delivering frames.", self.stall_count),
+            "frame_age_seconds": ("gauge", "Smoothed time between capturing a frame and using it.", "%.4f" % self.latency),
+        }
+
+    def stop(self):
+        # Stop the capture thread and wait for it to finish
+        self.running = False
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def release(self):
+        # Stop capturing and release the video source, or have the capture thread release it as it exits
+        with self.lock:
+            self.closing = True
+            owned_by_thread = self.capturing
+        self.stop()
+        if not owned_by_thread:
+            self.video.release()
+
+
+def parse_source(source):
+    # Device indices are given as numbers, anything else is a file path or stream URL
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def camera_name(source):
+    # Name for a source in events, file names and metrics labels: the source itself, minus any
+    # user name and password in a stream URL
+    name = str(source)
+    if is_stream(name):
+        parts = urllib.parse.urlsplit(name)
+        if "@" in parts.netloc:
+            name = urllib.parse.urlunsplit(parts._replace(netloc=parts.netloc.rpartition("@")[2]))
+    return name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read a camera or stream and print its frame rate, latency and reconnects.")
+    parser.add_argument("source", help="device index, stream URL or video file")
+    parser.add_argument("--stall-timeout", type=float, default=5.0, help="seconds without a frame before reconnecting")
+    parser.add_argument("--loop", action="store_true", help="play a video file in a loop, as a stand-in for a camera")
+    parser.add_argument("--seconds", type=float, default=0.0, help="stop after this long (default: run until interrupted)")
+    args = parser.parse_args(argv)
+
+    grabber = FrameGrabber(parse_source(args.source), stall_timeout=args.stall_timeout, loop=args.loop).start()
+    started = time.monotonic()
+    last_count = 0
+    try:
+        while not args.seconds or time.monotonic() - started < args.seconds:
+            # Use frames as fast as a consumer would, then report once a second
+            deadline = time.monotonic() + 1.0
+            while time.monotonic() < deadline:
+                grabber.read(timeout=0.1)
+            print("%5.1f fps  age %6.1f ms  dropped %d  stalls %d  reconnects %d  %s" % (
+                grabber.frame_count - last_count, grabber.latency * 1000.0,
+                grabber.dropped_count, grabber.stall_count, grabber.reconnect_count,
+                "connected" if grabber.connected else "waiting"))
+            last_count = grabber.frame_count
+    except KeyboardInterrupt:
+        pass
+    finally:
+        grabber.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# User accounts with salted scrypt password hashes and short-lived sessions.
+# Pick the cost for this machine with: python -m credentials
+import argparse
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+# scrypt cost: n is the CPU/memory cost (a power of two), r the block size and p the parallelism.
+# Memory use is 128 * n * r bytes, 32 MB and about 100 ms per hash with these defaults.
+DEFAULT_N = 2 ** 15
+DEFAULT_R = 8
+DEFAULT_P = 1
+
+HASH_PREFIX = "scrypt"
+
+
+def hash_password(password, n=DEFAULT_N, r=DEFAULT_R, p=DEFAULT_P, salt=None):
+    # Returns "scrypt$n$r$p$salt$hash", the parameters are stored with the hash so the cost can change later
+    salt = os.urandom(16) if salt is None else salt
+    key = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p + (1 << 20), dklen=32)
+    return "%s$%d$%d$%d$%s$%s" % (HASH_PREFIX, n, r, p, salt.hex(), key.hex())
+
+
+def verify_password(password, stored):
+    # Returns (matches, parameters): the parameters the hash was made with, or None for an old plaintext password
+    if not stored.startswith(HASH_PREFIX + "$"):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), None
+    _, n, r, p, salt, _ = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    candidate = hash_password(password, n, r, p, bytes.fromhex(salt))
+    return hmac.compare_digest(candidate, stored), (n, r, p)
+
+
+class CredentialStore:
+    def __init__(self, path="HomeSecurity.db", n=DEFAULT_N, r=DEFAULT_R, p=DEFAULT_P, session_seconds=900):
+        self.path = path
+        self.cost = (n, r, p)
+
+        # Sessions live in memory only: token -> [username, expiry time]
+        self.session_seconds = session_seconds
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+        # Hashing runs on a worker thread so the Tk window stays responsive; scrypt releases the GIL
+        self.worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        # Checked against when the username doesn't exist, so unknown users take as long as known ones
+        self.dummy_hash = None
+
+        # Create the table if it doesn't exist
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        username TEXT PRIMARY KEY,
+                        password TEXT,
+                        birthday TEXT
+                    )
+                """)
+        finally:
+            connection.close()
+
+    def submit(self, function, *args):
+        # Run one of the methods below on the worker thread, returns a concurrent.futures.Future
+        return self.worker.submit(function, *args)
+
+    def login(self, username, password):
+        # Returns a session token, or None when the username or password is wrong
+        connection = sqlite3.connect(self.path)
+        try:
+            row = connection.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None or row[0] is None:
+                if self.dummy_hash is None:
+                    self.dummy_hash = hash_password(secrets.token_hex(8), *self.cost)
+                verify_password(password, self.dummy_hash)
+                return None
+            matches, cost = verify_password(password, row[0])
+            if not matches:
+                return None
+            if cost != self.cost:
+                # Upgrade plaintext passwords and hashes made with an older cost setting
+                with connection:
+                    connection.execute("UPDATE users SET password = ? WHERE username = ?",
+                                       (hash_password(password, *self.cost), username))
+        finally:
+            connection.close()
+        return self.start_session(username)
+
+    def signup(self, username, password, birthday):
+        # Returns False when the username is taken
+        stored = hash_password(password, *self.cost)
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute("INSERT INTO users (username, password, birthday) VALUES (?, ?, ?)",
+                                   (username, stored, birthday))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            connection.close()
+
+    def reset_password(self, username, birthday, password):
+        # Passwords can't be read back from their hash, so recovery sets a new one after checking the birthday
+        stored = hash_password(password, *self.cost)
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                cursor = connection.execute("UPDATE users SET password = ? WHERE username = ? AND birthday = ?",
+                                            (stored, username, birthday))
+            changed = cursor.rowcount == 1
+        finally:
+            connection.close()
+        if changed:
+            self.end_sessions(username)
+        return changed
+
+    def start_session(self, username):
+        token = secrets.token_urlsafe(24)
+        with self.lock:
+            self.sessions[token] = [username, time.monotonic() + self.session_seconds]
+        return token
+
+    def check_session(self, token):
+        # Returns the username for a live session and extends it, or None; no hashing involved
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if session[1] <= now:
+                del self.sessions[token]
+                return None
+            session[1] = now + self.session_seconds
+            return session[0]
+
+    def logout(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def end_sessions(self, username):
+        with self.lock:
+            for token in [token for token, session in self.sessions.items() if session[0] == username]:
+                del self.sessions[token]
+
+    def close(self):
+        self.worker.shutdown(wait=False)
+
+
+def benchmark(costs, logins):
+    # Time hashing alone and a full login (database lookup plus verify) for each cost setting
+    # The databases go in a temporary directory that is removed afterwards
+    with tempfile.TemporaryDirectory() as directory:
+        print("%-8s %-3s %-3s %8s %10s %12s %12s" % ("n", "r", "p", "memory", "hash", "login p50", "session"))
+        for n, r, p in costs:
+            start = time.perf_counter()
+            hash_password("benchmark", n, r, p)
+            hash_ms = (time.perf_counter() - start) * 1000.0
+
+            store = CredentialStore(os.path.join(directory, "%d-%d-%d.db" % (n, r, p)), n, r, p)
+            store.signup("benchmark", "benchmark", "")
+            timings = []
+            for _ in range(logins):
+                start = time.perf_counter()
+                token = store.submit(store.login, "benchmark", "benchmark").result()
+                timings.append((time.perf_counter() - start) * 1000.0)
+            start = time.perf_counter()
+            store.check_session(token)
+            session_ms = (time.perf_counter() - start) * 1000.0
+            store.close()
+
+            timings.sort()
+            print("%-8d %-3d %-3d %6d MB %7.1f ms %9.1f ms %9.3f ms" % (
+                n, r, p, 128 * n * r // (1 << 20), hash_ms, timings[len(timings) // 2], session_ms))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time password hashing and logins for a range of scrypt costs.")
+    parser.add_argument("--logins", type=int, default=5, help="logins to time per cost setting")
+    args = parser.parse_args(argv)
+    costs = [(2 ** 13, 8, 1), (2 ** 14, 8, 1), (DEFAULT_N, DEFAULT_R, DEFAULT_P), (2 ** 16, 8, 1), (2 ** 17, 8, 1)]
+    benchmark(costs, args.logins)
+    print("\nDefault: n=%d r=%d p=%d. Aim for the largest cost that keeps a login under about 250 ms." % (
+        DEFAULT_N, DEFAULT_R, DEFAULT_P))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import cv2
+import numpy as np
+
+from background import create_background_model
+from bands import BandPool
+from buffers import FrameBuffers
+from gate import ChangeGate
+from regions import component_boxes, merge_boxes, merge_shape
+
+# How the changed regions are turned into boxes: a Python loop over findContours, or one
+# connectedComponentsWithStats call with the area filter and the merge of touching boxes done in NumPy
+EXTRACTION_MODES = ("contours", "components")
+
+
+def odd_kernel_size(size):
+    # Gaussian kernels need an odd size of at least 3
+    size = max(3, int(round(size)))
+    return size if size % 2 else size + 1
+
+
+class MotionDetector:
+    def __init__(self, blur_size=21, delta_threshold=30, min_area=500, dilate_iterations=2, scale=1.0,
+                 background="prev", gate=True, threads=1, extraction="contours", merge_distance=0):
+        # Detection settings, the defaults match the original detect_motion loop.
+        # blur_size and min_area are given for full resolution frames.
+        self.blur_size = blur_size
+        self.delta_threshold = delta_threshold
+        self.min_area = min_area
+        self.dilate_iterations = dilate_iterations
+
+        # Model of the background each frame is compared against
+        self.background = create_background_model(background, delta_threshold=delta_threshold)
+
+        # Cheap check on a thumbnail that skips the full pipeline while nothing changes
+        self.gate = ChangeGate(delta_threshold=delta_threshold, open_area=min_area / 2.0) if gate else None
+
+        # Include/exclude zones, None to use the whole frame
+        self.zones = None
+
+        # Intermediate images are allocated once per resolution and reused.
+        # The blurred gray frame is double-buffered because the background model keeps the previous one.
+        self.buffers = FrameBuffers()
+        self.current = 0
+
+        # Allocations made by the last call to detect(), zero once the loop is in steady state
+        self.frame_allocations = 0
+
+        # Optional metrics.StageTimer, stages are only timed while one is set
+        self.timer = None
+
+        # With more than one thread the per-pixel stages run in horizontal bands on a thread pool
+        self.pool = BandPool(threads) if threads > 1 else None
+
+        # Region extraction, in components mode boxes closer than merge_distance (full resolution pixels) are combined
+        if extraction not in EXTRACTION_MODES:
+            raise ValueError("unknown extraction mode %r, expected one of %s" % (extraction, ", ".join(EXTRACTION_MODES)))
+        self.extraction = extraction
+        self.merge_distance = merge_distance
+
+        self.set_scale(scale)
+
+    def set_scale(self, scale):
+        # Run detection on a frame shrunk by this factor, e.g. 0.5 or 0.25
+        if not 0.0 < scale <= 1.0:
+            raise ValueError("scale must be between 0 and 1")
+        self.scale = scale
+
+        # Scale the blur kernel with the frame size and the area threshold with the pixel count
+        self.scaled_blur_size = odd_kernel_size(self.blur_size * scale)
+        self.scaled_min_area = self.min_area * scale * scale
+
+        # The background has a different size now
+        self.background.reset()
+
+    def reset(self):
+        # Forget the background and the gate's reference after the source reconnects, the new
+        # connection can start on a different scene or exposure
+        self.background.reset()
+        if self.gate is not None:
+            self.gate.reset()
+
+    def set_zones(self, zones):
+        # Restrict detection to a DetectionZones instance, or pass None for the whole frame.
+        # The cropped frame has a different size, so the background starts over.
+        self.zones = zones
+        self.background.reset()
+        if self.gate is not None:
+            self.gate.reset()
+
+    def metric_values(self):
+        # Counters for metrics.PipelineMetrics.add_collector()
+        return {
+            "detector_frame_allocations": ("gauge", "Image buffers allocated by the last detection, 0 in steady state.", self.frame_allocations),
+            "detector_allocations_total": ("counter", "Image buffers allocated by the detector since it started.", self.allocations()),
+        }
+
+    def set_timer(self, timer):
+        # Time each pipeline stage with a metrics.StageTimer, or None to stop timing
+        self.timer = timer
+        self.background.timer = timer
+
+    def detect(self, frame):
+        allocations_before = self.allocations()
+        buffers = self.buffers
+        timer = self.timer
+        if timer:
+            timer.start()
+
+        zone_mask = None
+        offset_x = offset_y = 0
+        if self.zones is not None:
+            # Crop to the include zones before any per-pixel work, the mask is built once per resolution
+            height, width = frame.shape[:2]
+            (offset_x, offset_y, roi_width, roi_height), zone_mask = self.zones.mask(width, height, self.scale)
+            if (roi_width, roi_height) != (width, height):
+                frame = frame[offset_y:offset_y + roi_height, offset_x:offset_x + roi_width]
+
+        if self.gate is not None:
+            is_open = self.gate.check(frame, zone_mask)
+            if timer:
+                timer.mark("gate")
+            if not is_open:
+                if self.gate.refreshed:
+                    # The gate follows slow changes like the light over the day by taking a new reference
+                    # every few frames. Feed the background model the same frames, otherwise it would still
+                    # hold the frame from before the gate closed and the whole image would differ on reopening.
+                    # Only the model needs the frame, so the zones, dilation and region extraction are skipped.
+                    self.difference_frame(self.shrink(frame))
+                else:
+                    self.background.skip()
+                # Nothing is changing, skip the blur, threshold and contour work
+                self.frame_allocations = self.allocations() - allocations_before
+                return []
+
+        dilated = self.filter_frame(self.shrink(frame), zone_mask)
+        if dilated is None:
+            # The background model is still warming up
+            self.frame_allocations = self.allocations() - allocations_before
+            return []
+
+        if self.extraction == "components":
+            # Label the regions and filter them by pixel count in one call, so noise blobs cost no Python work,
+            # then merge the boxes that touch or are within merge_distance
+            labels = buffers.get("labels", dilated.shape, np.int32)
+            boxes = component_boxes(dilated, self.scaled_min_area, labels)
+            distance = self.merge_distance * self.scale
+            size = merge_shape(dilated.shape, distance)
+            boxes = merge_boxes(boxes, distance, dilated.shape, buffers.get("merge", size), buffers.get("merge_labels", size, np.int32))
+            boxes = [tuple(box) for box in boxes.tolist()]
+            if timer:
+                timer.mark("components")
+        else:
+            # Find contours of the dilated image, findContours does not modify its input so no copy is needed
+            contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+            # Keep the bounding boxes of the contours that are large enough
+            boxes = []
+            for contour in contours:
+                if cv2.contourArea(contour) > self.scaled_min_area:
+                    boxes.append(cv2.boundingRect(contour))
+            if timer:
+                timer.mark("contours")
+
+        if self.scale != 1.0:
+            # Map the boxes back to full resolution coordinates
+            boxes = self.scale_boxes(boxes, frame.shape)
+
+        if offset_x or offset_y:
+            # Move the boxes from the cropped frame back into the full frame
+            boxes = [(x + offset_x, y + offset_y, w, h) for (x, y, w, h) in boxes]
+
+        self.frame_allocations = self.allocations() - allocations_before
+        return boxes
+
+    def shrink(self, frame):
+        if self.scale == 1.0:
+            return frame
+
+        # Shrink the frame first so the color conversion also runs on fewer pixels.
+        # Linear interpolation is much cheaper than INTER_AREA and the blur below hides the aliasing.
+        height, width = frame.shape[:2]
+        # A small zone can crop the frame to a few pixels, keep at least one
+        size = (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale))))
+        small = self.buffers.get("small", (size[1], size[0], 3))
+        small = self.buffers.keep("small", cv2.resize(frame, size, dst=small, interpolation=cv2.INTER_LINEAR))
+        if self.timer:
+            self.timer.mark("resize")
+        return small
+
+    def filter_frame(self, small, zone_mask):
+        # Turn the frame into a dilated mask of the pixels that changed, or None while the background warms up
+        thresh = self.difference_frame(small)
+        if thresh is None:
+            return None
+        if self.pool is not None and self.background.supports_bands:
+            return self.dilate_bands(thresh, zone_mask)
+        return self.dilate(thresh, zone_mask)
+
+    def difference_frame(self, small):
+        # Run the per-pixel stages on the thread pool when there is one and the background model allows it
+        if self.pool is not None and self.background.supports_bands:
+            return self.difference_bands(small)
+        return self.difference(small)
+
+    def difference(self, small):
+        # Mask of the pixels that differ from the background model, which learns from the frame on the way
+        buffers = self.buffers
+        timer = self.timer
+        shape = small.shape[:2]
+
+        # Convert the frame to grayscale
+        gray = buffers.get("gray", shape)
+        gray = buffers.keep("gray", cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=gray))
+        if timer:
+            timer.mark("convert")
+
+        # Blur the frame to reduce noise, alternating between the two blur buffers
+        name = "blurred%d" % self.current
+        self.current = 1 - self.current
+        blurred = buffers.get(name, shape)
+        blurred = buffers.keep(name, cv2.GaussianBlur(gray, (self.scaled_blur_size, self.scaled_blur_size), 0, dst=blurred))
+        if timer:
+            timer.mark("blur")
+
+        # Find the pixels that differ from the background, None while the model is still warming up
+        return self.background.apply(blurred)
+
+    def dilate(self, thresh, zone_mask):
+        # Mask out the zones and grow the changed pixels into solid regions
+        buffers = self.buffers
+        timer = self.timer
+
+        if zone_mask is not None:
+            # Ignore changes outside the include zones and inside the exclude zones
+            thresh = cv2.bitwise_and(thresh, zone_mask, dst=thresh)
+            if timer:
+                timer.mark("zones")
+
+        # Apply image dilation to fill in the holes
+        dilated = buffers.get("dilated", thresh.shape)
+        dilated = buffers.keep("dilated", cv2.dilate(thresh, None, dst=dilated, iterations=self.dilate_iterations))
+        if timer:
+            timer.mark("dilate")
+        return dilated
+
+    def difference_bands(self, small):
+        # Same as difference(), with every stage split into horizontal bands on the thread pool.
+        # Blur and dilate read rows above and below their band, so each band is filtered with
+        # a margin of extra rows into its own scratch buffer and only its own rows are copied out.
+        # Each stage waits for all bands of the previous one, so the margins hold finished rows.
+        buffers = self.buffers
+        timer = self.timer
+        pool = self.pool
+        shape = small.shape[:2]
+        bands = pool.split(shape[0])
+
+        # Convert the frame to grayscale
+        gray = buffers.get("gray", shape)
+
+        def convert(first, end):
+            cv2.cvtColor(small[first:end], cv2.COLOR_BGR2GRAY, dst=gray[first:end])
+
+        pool.run(convert)
+        if timer:
+            timer.mark("convert")
+
+        # Blur the frame to reduce noise, alternating between the two blur buffers
+        name = "blurred%d" % self.current
+        self.current = 1 - self.current
+        blurred = buffers.get(name, shape)
+        size = self.scaled_blur_size
+        scratch = self.band_buffers("blur", bands, size // 2, shape)
+
+        def blur(first, end):
+            top, bottom = pool.halo(first, end, size // 2)
+            band = cv2.GaussianBlur(gray[top:bottom], (size, size), 0, dst=scratch[first])
+            blurred[first:end] = band[first - top:end - top]
+
+        pool.run(blur)
+        if timer:
+            timer.mark("blur")
+
+        # Find the pixels that differ from the background
+        return self.background.apply(blurred, pool)
+
+    def dilate_bands(self, thresh, zone_mask):
+        # Same as dilate(), in bands on the thread pool after masking out the zones.
+        # Each dilation iteration reads one row further.
+        timer = self.timer
+        pool = self.pool
+        shape = thresh.shape
+        bands = pool.split(shape[0])
+        dilated = self.buffers.get("dilated", shape)
+        margin = self.dilate_iterations
+        scratch = self.band_buffers("dilate", bands, margin, shape)
+        masked = self.band_buffers("zones", bands, margin, shape) if zone_mask is not None else None
+
+        def dilate(first, end):
+            top, bottom = pool.halo(first, end, margin)
+            source = thresh[top:bottom]
+            if masked is not None:
+                source = cv2.bitwise_and(source, zone_mask[top:bottom], dst=masked[first])
+            band = cv2.dilate(source, None, dst=scratch[first], iterations=self.dilate_iterations)
+            dilated[first:end] = band[first - top:end - top]
+
+        pool.run(dilate)
+        if timer:
+            timer.mark("zones" if zone_mask is not None else "dilate")
+        return dilated
+
+    def band_buffers(self, name, bands, margin, shape):
+        # Scratch buffers for each band and its margin, allocated up front so the threads never allocate
+        scratch = {}
+        for (first, end) in bands:
+            top, bottom = self.pool.halo(first, end, margin)
+            scratch[first] = self.buffers.get("%s%d" % (name, first), (bottom - top, shape[1]))
+        return scratch
+
+    def allocations(self):
+        # Total image buffers allocated by the detector and its background model
+        allocations = self.buffers.allocations + self.background.buffers.allocations
+        if self.gate is not None:
+            allocations += self.gate.buffers.allocations
+        return allocations
+
+    def scale_boxes(self, boxes, shape):
+        height, width = shape[:2]
+        scaled = []
+        for (x, y, w, h) in boxes:
+            x0 = int(x / self.scale)
+            y0 = int(y / self.scale)
+            x1 = min(width, int(round((x + w) / self.scale)))
+            y1 = min(height, int(round((y + h) / self.scale)))
+            scaled.append((x0, y0, x1 - x0, y1 - y0))
+        return scaled
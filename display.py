@@ -0,0 +1,111 @@
+import time
+import tkinter as tk
+
+import cv2
+from PIL import Image, ImageTk
+
+from buffers import FrameBuffers
+
+
+class CanvasDisplay:
+    def __init__(self, canvas):
+        self.canvas = canvas
+
+        # One Tk image and one canvas item, created on the first frame and updated in place afterwards
+        self.photo = None
+        self.item = None
+
+        # Reused RGB conversion buffer
+        self.buffers = FrameBuffers()
+
+        # Render timing, last frame and a smoothed average, in milliseconds
+        self.last_render_ms = 0.0
+        self.render_ms = 0.0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+
+    def visible(self):
+        # winfo_viewable is 0 while the window is minimized, withdrawn or not mapped yet
+        return bool(self.canvas.winfo_viewable())
+
+    def show(self, frame):
+        # Skip the conversion entirely when nobody can see the result
+        if not self.visible():
+            self.frames_skipped += 1
+            return False
+
+        start = time.perf_counter()
+        height, width = frame.shape[:2]
+
+        # Convert the OpenCV image to RGB into the reused buffer and wrap it without copying
+        rgb = self.buffers.get("rgb", frame.shape)
+        rgb = self.buffers.keep("rgb", cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb))
+        image = Image.frombuffer("RGB", (width, height), rgb, "raw", "RGB", 0, 1)
+
+        if self.photo is None or self.photo.width() != width or self.photo.height() != height:
+            # First frame or the resolution changed: create the Tk image and point the canvas item at it
+            self.photo = ImageTk.PhotoImage(image)
+            if self.item is None:
+                self.item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+                # Keep the video underneath any overlay items
+                self.canvas.tag_lower(self.item)
+            else:
+                self.canvas.itemconfigure(self.item, image=self.photo)
+        else:
+            # Copy the new pixels into the existing Tk image
+            self.photo.paste(image)
+
+        self.last_render_ms = (time.perf_counter() - start) * 1000.0
+        if self.frames_rendered == 0:
+            self.render_ms = self.last_render_ms
+        else:
+            self.render_ms += 0.1 * (self.last_render_ms - self.render_ms)
+        self.frames_rendered += 1
+        return True
+
+
+class OverlayPool:
+    def __init__(self, canvas, size=32, text="Motion Detected!"):
+        self.canvas = canvas
+        self.text = text
+
+        # Create a fixed set of hidden rectangle and text items once, they are moved with coords()
+        # and shown or hidden as the motion regions change, never created or destroyed
+        self.rectangles = []
+        self.texts = []
+        for _ in range(size):
+            rectangle = canvas.create_rectangle(0, 0, 0, 0, outline="#00ff00", width=2, state=tk.HIDDEN, tags="overlay")
+            text = canvas.create_text(0, 0, text=text, fill="red", anchor=tk.SW, state=tk.HIDDEN, tags="overlay")
+            self.rectangles.append(rectangle)
+            self.texts.append(text)
+
+        # Number of items currently shown and the text each one shows
+        self.shown = 0
+        self.labels = [text] * size
+
+    def update(self, boxes, labels=None):
+        if labels is None:
+            labels = [self.text] * len(boxes)
+        if len(boxes) > len(self.rectangles):
+            # More regions than items, show the largest ones
+            order = sorted(range(len(boxes)), key=lambda i: boxes[i][2] * boxes[i][3], reverse=True)[:len(self.rectangles)]
+            boxes = [boxes[i] for i in order]
+            labels = [labels[i] for i in order]
+
+        # Move the items to the current motion regions
+        for index, (x, y, w, h) in enumerate(boxes):
+            self.canvas.coords(self.rectangles[index], x, y, x + w, y + h)
+            self.canvas.coords(self.texts[index], x, max(y - 2, 12))
+            if labels[index] != self.labels[index]:
+                self.canvas.itemconfigure(self.texts[index], text=labels[index])
+                self.labels[index] = labels[index]
+            if index >= self.shown:
+                self.canvas.itemconfigure(self.rectangles[index], state=tk.NORMAL)
+                self.canvas.itemconfigure(self.texts[index], state=tk.NORMAL)
+
+        # Hide the items that are no longer needed
+        for index in range(len(boxes), self.shown):
+            self.canvas.itemconfigure(self.rectangles[index], state=tk.HIDDEN)
+            self.canvas.itemconfigure(self.texts[index], state=tk.HIDDEN)
+
+        self.shown = len(boxes)
@@ -0,0 +1,225 @@
+# Motion events: the emitter that turns per-frame boxes into events, and the SQLite store they are kept in.
+# Query the store with: python -m events --camera 3 --hours 12
+import argparse
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+
+def print_event(event):
+    # Write one JSON object per line so the output can be piped to other tools
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+class MotionEventEmitter:
+    def __init__(self, camera, cooldown=2.0, sink=print_event):
+        self.camera = camera
+        self.cooldown = cooldown
+        self.sink = sink
+
+        # State of the motion event in progress
+        self.start_ts = None
+        self.last_motion_ts = None
+        self.peak_area = 0
+        self.boxes = []
+
+    def emit(self, event_type, **fields):
+        # Hand the event to the sink (stdout by default)
+        event = {"type": event_type, "camera": self.camera}
+        event.update(fields)
+        self.sink(event)
+
+    def update(self, boxes, timestamp):
+        if boxes:
+            area = max(w * h for (x, y, w, h) in boxes)
+            if self.start_ts is None:
+                # Motion just started
+                self.start_ts = timestamp
+                self.peak_area = area
+                self.emit("motion_start", ts=timestamp, boxes=[list(box) for box in boxes])
+            self.last_motion_ts = timestamp
+            if area >= self.peak_area:
+                self.peak_area = area
+                self.boxes = boxes
+        elif self.start_ts is not None and timestamp - self.last_motion_ts >= self.cooldown:
+            # No motion for the cooldown period, close the event
+            self.finish()
+
+    def finish(self):
+        if self.start_ts is None:
+            return
+        self.emit(
+            "motion_end",
+            start_ts=self.start_ts,
+            end_ts=self.last_motion_ts,
+            peak_area=self.peak_area,
+            boxes=[list(box) for box in self.boxes],
+        )
+        self.start_ts = None
+        self.last_motion_ts = None
+        self.peak_area = 0
+        self.boxes = []
+
+
+class EventStore:
+    def __init__(self, path="HomeSecurity.db", batch_size=200, flush_interval=1.0, clip_history=64):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Writes are queued and committed in batches by a single writer thread
+        self.writes = queue.Queue()
+        self.local = threading.local()
+
+        # Recent clips as (path, camera, start, end), only used by the writer thread. A clip can finish
+        # before the events in it are stored (post-roll shorter than the cooldown), so events stored
+        # later still look up their clip here.
+        self.clips = deque(maxlen=clip_history)
+
+        # Create the table before anything can query it
+        connection = self.connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS motion_events (
+                id INTEGER PRIMARY KEY,
+                camera TEXT NOT NULL,
+                start_ts REAL NOT NULL,
+                end_ts REAL,
+                peak_area INTEGER,
+                boxes TEXT,
+                clip_path TEXT,
+                thumbnail_path TEXT
+            );
+            CREATE INDEX IF NOT EXISTS motion_events_camera_start ON motion_events (camera, start_ts);
+            CREATE INDEX IF NOT EXISTS motion_events_start ON motion_events (start_ts);
+        """)
+        connection.commit()
+
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        # SQLite connections can't be shared between threads, each thread gets its own
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30.0)
+            # WAL only needs a full sync at checkpoints, which keeps batched commits cheap
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def add_event(self, camera, start_ts, end_ts, peak_area, boxes, clip_path=None, thumbnail_path=None):
+        # Queue an event for the writer thread, returns immediately
+        self.writes.put(("event", (str(camera), start_ts, end_ts, peak_area, json.dumps([list(box) for box in boxes]),
+                                   clip_path, thumbnail_path)))
+
+    def attach_clip(self, camera, start_ts, end_ts, clip_path):
+        # Link a clip to every event of the camera that starts within it, whether the event
+        # is already stored or comes later. The times are the ones the clip recorder was given.
+        self.writes.put(("clip", (clip_path, str(camera), start_ts, end_ts)))
+
+    def add_motion_end(self, event):
+        # Sink for MotionEventEmitter: store finished events and ignore the rest
+        if event["type"] == "motion_end":
+            self.add_event(event["camera"], event["start_ts"], event["end_ts"], event["peak_area"], event["boxes"],
+                           thumbnail_path=event.get("thumbnail_path"))
+
+    def write_loop(self):
+        connection = self.connect()
+        running = True
+        while running:
+            # Wait for the first write, then gather more until the batch is full or the interval is over
+            item = self.writes.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.writes.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if item is None:
+                running = False
+
+            # Commit the whole batch in one transaction
+            if batch:
+                with connection:
+                    for kind, params in batch:
+                        if kind == "clip":
+                            self.clips.append(params)
+                            connection.execute(
+                                "UPDATE motion_events SET clip_path = ? WHERE camera = ? AND start_ts BETWEEN ? AND ?", params)
+                        else:
+                            connection.execute(
+                                "INSERT INTO motion_events (camera, start_ts, end_ts, peak_area, boxes, clip_path, thumbnail_path) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)", self.with_clip(params))
+        connection.close()
+
+    def with_clip(self, params):
+        # Fill in the clip of an event stored after its clip was attached
+        camera, start_ts = params[0], params[1]
+        if params[5] is None:
+            for clip_path, clip_camera, clip_start, clip_end in reversed(self.clips):
+                if clip_camera == camera and clip_start <= start_ts <= clip_end:
+                    return params[:5] + (clip_path,) + params[6:]
+        return params
+
+    def events(self, camera=None, start_ts=None, end_ts=None, limit=1000):
+        # Events that started in the given time range, newest first
+        clauses = []
+        params = []
+        if camera is not None:
+            clauses.append("camera = ?")
+            params.append(str(camera))
+        if start_ts is not None:
+            clauses.append("start_ts >= ?")
+            params.append(start_ts)
+        if end_ts is not None:
+            clauses.append("start_ts < ?")
+            params.append(end_ts)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        params.append(limit)
+
+        cursor = self.connect().execute(
+            "SELECT id, camera, start_ts, end_ts, peak_area, boxes, clip_path, thumbnail_path "
+            "FROM motion_events" + where + " ORDER BY start_ts DESC LIMIT ?",
+            params,
+        )
+        columns = [column[0] for column in cursor.description]
+        rows = []
+        for row in cursor:
+            event = dict(zip(columns, row))
+            event["boxes"] = json.loads(event["boxes"]) if event["boxes"] else []
+            rows.append(event)
+        return rows
+
+    def close(self):
+        # Flush the pending writes and stop the writer thread
+        self.writes.put(None)
+        self.thread.join(timeout=10.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List stored motion events.")
+    parser.add_argument("--db", default="HomeSecurity.db", help="database file")
+    parser.add_argument("--camera", default=None, help="only show events from this camera")
+    parser.add_argument("--hours", type=float, default=24.0, help="how far back to look")
+    parser.add_argument("--limit", type=int, default=100, help="maximum number of events")
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.db)
+    now = time.time()
+    for event in store.events(args.camera, now - args.hours * 3600.0, now, args.limit):
+        print(json.dumps(event))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import bisect
+import http.server
+import os
+import threading
+import time
+
+
+def escape_label(value):
+    # Label values are quoted in the exposition format, backslash, double quote and newline must be escaped
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class StageTimer:
+    def __init__(self):
+        # Seconds spent in each named stage, one sample per frame that reached it
+        self.samples = {}
+        self.last = None
+
+    def start(self):
+        # Call at the start of a frame, before the first stage
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        # Call at the end of a stage, it is charged the time since the previous mark
+        now = time.perf_counter()
+        self.samples.setdefault(stage, []).append(now - self.last)
+        self.last = now
+
+    def reset(self):
+        self.samples = {}
+
+
+# Histogram bucket bounds in seconds, from 100 microseconds to one second
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class RollingHistogram:
+    def __init__(self, window=512):
+        # The last few samples, for live percentiles
+        self.window = [0.0] * window
+        self.index = 0
+        self.filled = 0
+
+        # Cumulative bucket counts, sum and count since start, for export
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.window[self.index] = seconds
+        self.index = (self.index + 1) % len(self.window)
+        if self.filled < len(self.window):
+            self.filled += 1
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q):
+        # Percentile of the recent samples in seconds
+        if not self.filled:
+            return 0.0
+        samples = sorted(self.window[:self.filled])
+        return samples[min(self.filled - 1, int(q / 100.0 * self.filled))]
+
+
+class PipelineMetrics:
+    def __init__(self, camera="0"):
+        self.camera = str(camera)
+
+        # Rolling histogram per stage
+        self.stages = {}
+        self.last = None
+
+        # Functions called at export time that return {name: (type, help, value)},
+        # so counters that already exist elsewhere cost nothing on the hot path
+        self.collectors = []
+
+    def start(self):
+        # Same interface as StageTimer, so it can be handed to MotionDetector.set_timer()
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.observe(stage, now - self.last)
+        self.last = now
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = RollingHistogram()
+        histogram.observe(seconds)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def summary(self):
+        # One line per stage with the recent p50, p95 and p99 in milliseconds, for the HUD
+        lines = []
+        for stage, histogram in list(self.stages.items()):
+            lines.append("%-10s p50 %6.2f  p95 %6.2f  p99 %6.2f ms" % (
+                stage, histogram.percentile(50) * 1000.0, histogram.percentile(95) * 1000.0, histogram.percentile(99) * 1000.0))
+        return "\n".join(lines)
+
+    def prometheus(self):
+        # Render everything in the Prometheus text exposition format
+        labels = 'camera="%s"' % escape_label(self.camera)
+        lines = [
+            "# HELP homesecurity_stage_seconds Time spent in each stage of the capture and detection pipeline.",
+            "# TYPE homesecurity_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            stage_labels = '%s,stage="%s"' % (labels, escape_label(stage))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), list(histogram.bucket_counts)):
+                cumulative += count
+                bound_text = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append('homesecurity_stage_seconds_bucket{%s,le="%s"} %d' % (stage_labels, bound_text, cumulative))
+            lines.append("homesecurity_stage_seconds_sum{%s} %.9f" % (stage_labels, histogram.sum))
+            lines.append("homesecurity_stage_seconds_count{%s} %d" % (stage_labels, histogram.count))
+
+        values = {}
+        for collector in self.collectors:
+            values.update(collector())
+        for name, (metric_type, help_text, value) in sorted(values.items()):
+            lines.append("# HELP homesecurity_%s %s" % (name, help_text))
+            lines.append("# TYPE homesecurity_%s %s" % (name, metric_type))
+            lines.append("homesecurity_%s{%s} %s" % (name, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        # Write to a temporary file and rename it, so a scraper never reads half a file
+        temporary = path + ".tmp"
+        with open(temporary, "w") as output:
+            output.write(self.prometheus())
+        os.replace(temporary, path)
+
+
+class MetricsServer:
+    def __init__(self, metrics, port=9108, host="127.0.0.1"):
+        self.metrics = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                # Keep scrapes out of the console
+                pass
+
+        # Serve scrapes on a background thread, by default only to this machine
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,194 @@
+# Headless motion detection daemon, run with: python -m motion_daemon --source 0
+import argparse
+import hmac
+import os
+import time
+
+import cv2
+
+from background import BACKGROUND_MODELS
+from capture import FrameGrabber, camera_name, parse_source
+from detector import EXTRACTION_MODES, MotionDetector
+from events import EventStore, MotionEventEmitter, print_event
+from metrics import MetricsServer, PipelineMetrics
+from recorder import ClipRecorder
+from snapshots import SnapshotStore
+from stream_server import MJPEGServer
+from zones import DetectionZones, ZoneStore
+
+
+def open_source(source):
+    # Live sources are read on a capture thread so detection always sees the freshest frame,
+    # files are read frame by frame so nothing is skipped
+    if isinstance(source, str) and os.path.isfile(source):
+        return cv2.VideoCapture(source), False
+    return FrameGrabber(source).start(), True
+
+
+def file_start_time(video, path):
+    # Wall clock time a recording started, taken as its modification time less its length, so events
+    # from a file are stored at the time they happened instead of seconds from the start of the file
+    fps = video.get(cv2.CAP_PROP_FPS)
+    frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+    if fps > 0 and frames > 0:
+        return os.path.getmtime(path) - frames / fps
+    # Without a known length, count from when reading started
+    return time.time()
+
+
+def process(source, detector, emitter, recorder=None, metrics=None, stream=None, snapshots=None, on_frame=None, on_wait=None):
+    # Read the source until it ends: detect motion in every frame, emit the events and hand the frames to
+    # the recorder and stream. on_frame(frame, timestamp, started) is called after each frame, started is
+    # True on the frame a motion event began on. on_wait() is called when a live source has had no new frame
+    # for a second, e.g. while it reconnects. Shared by the daemon and the supervisor's workers.
+    video, live = open_source(source)
+    if metrics is not None:
+        # Time the camera reads and detection stages and export the capture and recorder counters
+        detector.set_timer(metrics)
+        if live:
+            video.metrics = metrics
+        for collector in (video if live else None, recorder, detector, detector.gate, stream, snapshots):
+            if collector is not None:
+                metrics.add_collector(collector.metric_values)
+    start_time = None if live else file_start_time(video, source)
+    reconnect_count = 0
+    if recorder is not None and video.get(cv2.CAP_PROP_FPS) > 0:
+        # Record clips at the source's own frame rate
+        recorder.fps = video.get(cv2.CAP_PROP_FPS)
+    try:
+        while True:
+            if live:
+                ret, frame = video.read(timeout=1.0)
+                if not ret:
+                    if on_wait is not None:
+                        on_wait()
+                    continue
+                timestamp = time.time()
+                if video.reconnect_count != reconnect_count:
+                    # Don't compare the first frames of the new connection to the old one
+                    reconnect_count = video.reconnect_count
+                    detector.reset()
+            else:
+                ret, frame = video.read()
+                if not ret:
+                    # End of the file
+                    break
+                timestamp = start_time + video.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+            boxes = detector.detect(frame)
+            started = bool(boxes) and emitter.start_ts is None
+            emitter.update(boxes, timestamp)
+            if started and snapshots is not None:
+                # Keep a still of the frame the event started on
+                snapshots.add(emitter.camera, timestamp, frame, boxes)
+            if recorder is not None:
+                recorder.add_frame(frame, timestamp, bool(boxes))
+            if stream is not None:
+                stream.publish(frame, boxes)
+            if on_frame is not None:
+                on_frame(frame, timestamp, started)
+    finally:
+        emitter.finish()
+        video.release()
+        if recorder is not None:
+            recorder.close()
+
+
+def run(source, detector, emitter, recorder=None, metrics=None, metrics_file=None, stream=None, snapshots=None):
+    last_export = 0.0
+
+    def export_metrics(frame, timestamp, started):
+        # Refresh the Prometheus text file every few seconds
+        nonlocal last_export
+        if time.monotonic() - last_export >= 5.0:
+            metrics.write_textfile(metrics_file)
+            last_export = time.monotonic()
+
+    try:
+        process(source, detector, emitter, recorder, metrics, stream, snapshots, export_metrics if metrics_file is not None else None)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run motion detection without a GUI.")
+    parser.add_argument("--source", default="0", help="device index, video file or stream URL")
+    parser.add_argument("--camera", default=None, help="camera name used in the events (default: the source, without any password in it)")
+    parser.add_argument("--min-area", type=int, default=500, help="minimum contour area in pixels")
+    parser.add_argument("--threshold", type=int, default=30, help="pixel difference threshold")
+    parser.add_argument("--cooldown", type=float, default=2.0, help="seconds without motion that end an event")
+    parser.add_argument("--scale", type=float, default=1.0, help="detection scale, e.g. 0.5 or 0.25 for large frames")
+    parser.add_argument("--no-gate", action="store_true", help="run the full pipeline on every frame, even when nothing changes")
+    parser.add_argument("--background", choices=sorted(BACKGROUND_MODELS), default="prev", help="background model")
+    parser.add_argument("--threads", type=int, default=1, help="split each frame into bands processed on this many threads")
+    parser.add_argument("--extraction", choices=EXTRACTION_MODES, default="contours", help="how changed regions are turned into boxes")
+    parser.add_argument("--merge-distance", type=int, default=0, help="in components mode, merge boxes this many pixels apart")
+    parser.add_argument("--db", default=None, help="also store finished events in this SQLite database, and use the camera's detection zones from it")
+    parser.add_argument("--record", default=None, metavar="DIR", help="save a clip of every motion event in this directory")
+    parser.add_argument("--snapshots", default=None, metavar="DIR", help="save a still of every motion event in this directory")
+    parser.add_argument("--pre-roll", type=float, default=5.0, help="seconds of video kept before motion starts")
+    parser.add_argument("--post-roll", type=float, default=5.0, help="seconds of video kept after motion ends")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-file", default=None, help="write Prometheus metrics to this text file")
+    parser.add_argument("--stream-port", type=int, default=None, help="stream the video with motion boxes as MJPEG on this port")
+    parser.add_argument("--stream-host", default="127.0.0.1", help="address to serve the stream on, 0.0.0.0 for every interface")
+    parser.add_argument("--stream-token", default=None, help="require ?token=TOKEN on every stream request")
+    args = parser.parse_args(argv)
+
+    source = parse_source(args.source)
+    camera = args.camera if args.camera is not None else camera_name(args.source)
+    detector = MotionDetector(delta_threshold=args.threshold, min_area=args.min_area, scale=args.scale, background=args.background, gate=not args.no_gate, threads=args.threads,
+                              extraction=args.extraction, merge_distance=args.merge_distance)
+    store = EventStore(args.db) if args.db else None
+    if args.db:
+        # Skip the areas excluded in the GUI's zone editor, zones are stored by camera name
+        zones = ZoneStore(args.db).load(camera)
+        if zones:
+            detector.set_zones(DetectionZones(zones))
+
+    # Snapshots are indexed in the events database, or next to the files without one
+    snapshots = None
+    if args.snapshots:
+        snapshots = SnapshotStore(args.snapshots, args.db or os.path.join(args.snapshots, "snapshots.db"))
+
+    def sink(event):
+        if snapshots is not None and event["type"] == "motion_end":
+            event["thumbnail_path"] = snapshots.thumbnail_for(camera, event["start_ts"])
+        print_event(event)
+        if store is not None:
+            store.add_motion_end(event)
+
+    emitter = MotionEventEmitter(camera, cooldown=args.cooldown, sink=sink)
+    recorder = None
+    if args.record:
+        on_clip = None
+        if store is not None:
+            on_clip = lambda path, start, end: store.attach_clip(camera, start, end, path)
+        recorder = ClipRecorder(args.record, camera=camera, pre_seconds=args.pre_roll, post_seconds=args.post_roll, on_clip=on_clip)
+    metrics = None
+    server = None
+    if args.metrics_port is not None or args.metrics_file is not None:
+        metrics = PipelineMetrics(camera)
+        if args.metrics_port is not None:
+            server = MetricsServer(metrics, args.metrics_port).start()
+    stream = None
+    if args.stream_port is not None:
+        check_session = None
+        if args.stream_token:
+            check_session = lambda token: token if hmac.compare_digest(token.encode("utf-8"), args.stream_token.encode("utf-8")) else None
+        stream = MJPEGServer(args.stream_port, args.stream_host, snapshots=snapshots, check_session=check_session).start()
+    try:
+        run(source, detector, emitter, recorder, metrics, args.metrics_file, stream, snapshots)
+    finally:
+        if stream is not None:
+            stream.stop()
+        if snapshots is not None:
+            snapshots.close()
+        if store is not None:
+            store.close()
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import time
+
+import cv2
+
+from capture import FrameGrabber, camera_name
+from detector import MotionDetector
+from events import EventStore, MotionEventEmitter
+from metrics import MetricsServer, PipelineMetrics
+from recorder import ClipRecorder
+from scheduler import FramePacer
+from snapshots import SnapshotStore
+from stream_server import MJPEGServer
+from tracker import MotionTracker
+from zones import DetectionZones, ZoneStore
+
+
+class CameraPipeline:
+    def __init__(self, video_source=0, detection_scale=1.0, background="prev", clip_directory="clips",
+                 snapshot_directory="snapshots", metrics_port=None, metrics_file=None, stream_port=None, stream_host="127.0.0.1", database="HomeSecurity.db",
+                 check_session=None):
+        # Capture, detection, events and recording for one camera. It is opened once and keeps
+        # running while screens come and go; the live video screen attaches itself as the view.
+        self.camera = camera_name(video_source)
+        self.root = None
+        self.view = None
+
+        # Everything close() releases, set as it is opened so a failure halfway can undo the rest
+        self.video = None
+        self.recorder = None
+        self.events = None
+        self.event_store = None
+        self.snapshots = None
+        self.stream_server = None
+        self.metrics_server = None
+
+        try:
+            # Open the video source and read frames on a background thread
+            self.video = FrameGrabber(video_source).start()
+
+            # Pace the loop to the camera's frame rate and shed render/detect work when overloaded
+            self.pacer = FramePacer(self.video.get(cv2.CAP_PROP_FPS))
+
+            # Create the motion detector, a scale below 1 detects on a smaller copy of the frame
+            self.detector = MotionDetector(scale=detection_scale, background=background)
+
+            # Follow the motion regions from frame to frame so each object keeps its ID
+            self.tracker = MotionTracker()
+            self.tracks = []
+
+            # Reconnects seen so far, the detector and tracker start over after each one
+            self.reconnect_count = 0
+
+            # Load the camera's detection zones
+            self.zone_store = ZoneStore(database)
+            self.zones = self.zone_store.load(self.camera)
+            if self.zones:
+                self.detector.set_zones(DetectionZones(self.zones))
+
+            # Log motion events to the database, the writes are batched on a background thread
+            self.event_store = EventStore(database)
+            self.events = MotionEventEmitter(self.camera, sink=self.store_event)
+
+            # Keep a still of the frame each motion event started on, None to turn snapshots off
+            if snapshot_directory is not None:
+                self.snapshots = SnapshotStore(snapshot_directory, database)
+
+            # Save a clip of every motion event, including the seconds before it started
+            self.recorder = ClipRecorder(clip_directory, camera=self.camera, fps=1.0 / self.pacer.frame_interval(),
+                                         on_clip=lambda path, start, end: self.event_store.attach_clip(self.camera, start, end, path))
+
+            # Optionally stream the video with the motion boxes to browsers, check_session validates their tokens
+            if stream_port is not None:
+                self.stream_server = MJPEGServer(stream_port, stream_host, snapshots=self.snapshots,
+                                                 check_session=check_session).start()
+
+            # Per-stage timings and counters, only collected once enabled by the stats overlay or an export
+            self.metrics = PipelineMetrics(self.camera)
+            for source in (self.video, self.pacer, self.recorder, self.detector, self.detector.gate, self.stream_server, self.snapshots):
+                if source is not None:
+                    self.metrics.add_collector(source.metric_values)
+            self.metrics_enabled = False
+            self.metrics_file = metrics_file
+            if metrics_port is not None:
+                self.enable_metrics()
+                self.metrics_server = MetricsServer(self.metrics, metrics_port).start()
+            if metrics_file is not None:
+                self.enable_metrics()
+        except Exception:
+            # Don't leave the camera, worker threads or ports open, the next attempt would open them twice
+            self.close()
+            raise
+
+    def start(self, root):
+        # Run the pipeline from the Tk event loop
+        self.root = root
+        self.step()
+        if self.metrics_file is not None:
+            self.write_metrics()
+
+    def step(self):
+        start = time.perf_counter()
+
+        # Take the freshest frame from the capture thread, older ones are dropped
+        ret, frame, timestamp = self.video.read_with_timestamp()
+
+        if ret:
+            if self.video.reconnect_count != self.reconnect_count:
+                # The new connection can show a different scene, don't compare it to the old one
+                self.reconnect_count = self.video.reconnect_count
+                self.detector.reset()
+                self.tracker.reset()
+                self.tracks = []
+
+            # Under load, only detect and render every Nth frame
+            detect, render = self.pacer.start_frame(timestamp)
+
+            # Events and clips are stored with wall clock times, capture timestamps are monotonic.
+            # Both get the same time for a frame, so clips can be matched to the events they contain.
+            event_time = time.time() - (time.monotonic() - timestamp)
+
+            motion = None
+            if detect:
+                # Find the regions of the frame that changed since the previous frame
+                boxes = self.detector.detect(frame)
+                motion = bool(boxes)
+
+                started = motion and self.events.start_ts is None
+                self.events.update(boxes, event_time)
+
+                # Snapshot the frame a new event starts on, encoding happens on the store's own thread
+                if started and self.snapshots is not None:
+                    self.snapshots.add(self.camera, event_time, frame, boxes)
+
+                # Match the regions to the objects already being tracked
+                self.tracks = self.tracker.update(boxes, timestamp)
+
+            # Hand the frame to the clip recorder, encoding happens on its own thread
+            self.recorder.add_frame(frame, event_time, motion)
+
+            # Hand the frame to the stream server, which encodes it once for all its viewers
+            if self.stream_server is not None:
+                self.stream_server.publish(frame, [track.box for track in self.tracks])
+
+            # Draw the frame on the live video screen, if it is showing
+            rendered = False
+            if self.view is not None:
+                rendered = self.view.show_frame(frame, detect, render)
+
+            elapsed = time.perf_counter() - start
+            self.pacer.finish_frame(elapsed, detect, rendered)
+            if self.metrics_enabled:
+                self.metrics.observe("frame", elapsed)
+
+        # Schedule the next iteration for when the next camera frame is due
+        self.root.after(self.pacer.next_delay_ms(ret), self.step)
+
+    def store_event(self, event):
+        # Sink for the emitter: finished events are stored with the thumbnail of their snapshot
+        if event["type"] == "motion_end" and self.snapshots is not None:
+            event["thumbnail_path"] = self.snapshots.thumbnail_for(self.camera, event["start_ts"])
+        self.event_store.add_motion_end(event)
+
+    def enable_metrics(self):
+        # Start timing the capture and detection stages
+        if not self.metrics_enabled:
+            self.metrics_enabled = True
+            self.video.metrics = self.metrics
+            self.detector.set_timer(self.metrics)
+
+    def write_metrics(self):
+        # Refresh the Prometheus text file every few seconds
+        self.metrics.write_textfile(self.metrics_file)
+        self.root.after(5000, self.write_metrics)
+
+    def set_zones(self, zones):
+        # Store the edited zones and rasterize them once for the detector
+        self.zones = zones
+        self.zone_store.save(self.camera, zones)
+        self.detector.set_zones(DetectionZones(zones) if zones else None)
+
+    def close(self):
+        # Release the video source, finish any clip and event in progress and stop the servers
+        if self.video is not None:
+            self.video.release()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.events is not None:
+            self.events.finish()
+        if self.event_store is not None:
+            self.event_store.close()
+        if self.snapshots is not None:
+            self.snapshots.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.stream_server is not None:
+            self.stream_server.stop()
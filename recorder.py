@@ -0,0 +1,200 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class ClipRecorder:
+    def __init__(self, directory="clips", camera="camera", fps=30.0, pre_seconds=5.0, post_seconds=5.0,
+                 jpeg_quality=80, queue_bytes=64 * 1024 * 1024, pre_roll_width=640, pre_roll_fps=10.0, on_clip=None):
+        self.directory = directory
+        # The camera name becomes part of the file names, so keep it to safe characters
+        self.camera = "".join(c if c.isalnum() or c in "-_" else "_" for c in camera)
+        self.fps = fps if fps > 0 else 30.0
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.jpeg_quality = jpeg_quality
+
+        # Called with (path, start, end) when a clip has been written, start and end are the timestamps
+        # of its first and last frame as given to add_frame, so they match the motion event times
+        self.on_clip = on_clip
+
+        # Frames waiting for the encoder thread, limited by their size rather than their number so a 4K camera
+        # can't queue up gigabytes: 64 MB is about 10 frames at 1080p and 2 at 4K. add_frame never waits for room.
+        self.frames = queue.Queue()
+        self.queue_bytes = queue_bytes
+        self.queued_bytes = 0
+        self.queue_lock = threading.Lock()
+        self.dropped_count = 0
+
+        # Time of the last dropped frame with motion, so dropping frames doesn't end a clip early
+        self.dropped_motion = None
+
+        # Pre-roll of the last few seconds, stored as JPEG bytes to keep memory use down. Encoding every
+        # idle frame at full size would cost more than detecting on it, so the pre-roll is kept at
+        # pre_roll_fps frames a second and pre_roll_width pixels wide.
+        self.pre_roll = deque()
+        self.pre_roll_width = pre_roll_width
+        self.pre_roll_fps = pre_roll_fps
+        self.last_pre_roll = None
+
+        # State of the clip being written, only touched by the encoder thread
+        self.writer = None
+        self.clip_path = None
+        self.clip_start = None
+        self.clip_end = None
+        self.last_motion = None
+
+        # Frames written to the clip so far, frames are repeated or skipped to keep the clip at clip_fps
+        self.frames_written = 0
+        self.clip_fps = self.fps
+
+        # Smoothed seconds one VideoWriter.write() takes at the camera's resolution. Clips are written at
+        # no more frames per second than the writer keeps up with, a 4K clip may be written at 10 fps.
+        self.write_seconds = None
+        self.write_size = None
+
+        self.thread = threading.Thread(target=self.encode_loop, daemon=True)
+        self.thread.start()
+
+    def add_frame(self, frame, timestamp, motion=None):
+        # Queue a frame for the encoder thread. motion is True or False when detection ran on
+        # this frame and None when it was skipped. Frames are dropped if the encoder falls behind.
+        with self.queue_lock:
+            # An empty queue always takes the frame, even one larger than the limit
+            if self.queued_bytes and self.queued_bytes + frame.nbytes > self.queue_bytes:
+                self.dropped_count += 1
+                if motion:
+                    self.dropped_motion = timestamp
+                return
+            self.queued_bytes += frame.nbytes
+        self.frames.put_nowait((frame, timestamp, motion))
+
+    def metric_values(self):
+        # Counters for metrics.PipelineMetrics.add_collector()
+        return {
+            "recorder_queue_depth": ("gauge", "Frames waiting for the clip encoder.", self.frames.qsize()),
+            "recorder_queue_bytes": ("gauge", "Size of the frames waiting for the clip encoder.", self.queued_bytes),
+            "recorder_dropped_total": ("counter", "Frames dropped because the clip encoder fell behind.", self.dropped_count),
+        }
+
+    def encode_loop(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            frame, timestamp, motion = item
+            with self.queue_lock:
+                self.queued_bytes -= frame.nbytes
+                dropped_motion, self.dropped_motion = self.dropped_motion, None
+
+            if frame.shape != self.write_size and self.writer is None:
+                # New camera or resolution, time the writer while nothing is being recorded
+                self.calibrate(frame)
+
+            if motion or dropped_motion is not None:
+                self.last_motion = timestamp if motion else dropped_motion
+                if self.writer is None:
+                    self.start_clip(frame, timestamp)
+
+            if self.writer is not None:
+                # Write straight to the clip while recording
+                self.write_frame(frame, timestamp)
+                self.clip_end = timestamp
+                if timestamp - self.last_motion >= self.post_seconds:
+                    self.finish_clip()
+            elif self.last_pre_roll is None or timestamp - self.last_pre_roll >= 1.0 / self.pre_roll_fps:
+                # Keep a small compressed copy for the next clip's pre-roll
+                ok, data = cv2.imencode(".jpg", self.shrink(frame), [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if ok:
+                    self.pre_roll.append((timestamp, data))
+                    self.last_pre_roll = timestamp
+                while self.pre_roll and timestamp - self.pre_roll[0][0] > self.pre_seconds:
+                    self.pre_roll.popleft()
+
+        self.finish_clip()
+
+    def shrink(self, frame):
+        height, width = frame.shape[:2]
+        if width <= self.pre_roll_width:
+            return frame
+        # Linear interpolation is a few times cheaper than INTER_AREA on 4K frames, the aliasing is fine for a pre-roll
+        size = (self.pre_roll_width, max(1, height * self.pre_roll_width // width))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+
+    def calibrate(self, frame):
+        # Time a few writes of the frame and its mirror image to a scratch file with the clip codec
+        height, width = frame.shape[:2]
+        path = os.path.join(self.directory, ".calibrate-%s.mp4" % self.camera)
+        os.makedirs(self.directory, exist_ok=True)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (width, height))
+        frames = (frame, cv2.flip(frame, 1))
+        start = time.perf_counter()
+        for index in range(4):
+            writer.write(frames[index % 2])
+        self.write_seconds = (time.perf_counter() - start) / 4
+        writer.release()
+        if os.path.exists(path):
+            os.remove(path)
+        self.write_size = frame.shape
+
+    def write_frame(self, frame, timestamp):
+        # Write the frame as many times as the clip needs to reach its timestamp at clip_fps, so the clip plays
+        # at the speed it was recorded even with a slower pre-roll, dropped frames or a camera slower than fps
+        due = int(round((timestamp - self.clip_start) * self.clip_fps)) + 1
+        while self.frames_written < due:
+            start = time.perf_counter()
+            self.writer.write(frame)
+            self.write_seconds += 0.1 * (time.perf_counter() - start - self.write_seconds)
+            self.frames_written += 1
+
+    def start_clip(self, frame, timestamp):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # The clip starts with the oldest pre-roll frame
+        self.clip_start = self.pre_roll[0][0] if self.pre_roll else timestamp
+
+        # Name the clip after the camera and the wall clock time it started, frame timestamps are wall clock times
+        name = "%s_%s.mp4" % (self.camera, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.clip_start)))
+        self.clip_path = os.path.join(self.directory, name)
+        suffix = 1
+        while os.path.exists(self.clip_path):
+            # Recorded files are read faster than real time and can start several clips in one second
+            self.clip_path = os.path.join(self.directory, "%s-%d.mp4" % (name[:-4], suffix))
+            suffix += 1
+
+        # Leave a fifth of the encoder's time for the pre-roll and repeated frames, so it doesn't fall behind for good
+        self.clip_fps = min(self.fps, max(1.0, round(0.8 / self.write_seconds)))
+        height, width = frame.shape[:2]
+        self.writer = cv2.VideoWriter(self.clip_path, cv2.VideoWriter_fourcc(*"mp4v"), self.clip_fps, (width, height))
+        self.frames_written = 0
+
+        # Write the pre-roll first, scaled back up to the size of the clip
+        for pre_timestamp, data in self.pre_roll:
+            pre_frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if pre_frame is not None:
+                if pre_frame.shape != frame.shape:
+                    pre_frame = cv2.resize(pre_frame, (width, height), interpolation=cv2.INTER_LINEAR)
+                self.write_frame(pre_frame, pre_timestamp)
+        self.pre_roll.clear()
+        self.last_pre_roll = None
+
+    def finish_clip(self):
+        if self.writer is None:
+            return
+        self.writer.release()
+        self.writer = None
+        if self.on_clip is not None:
+            self.on_clip(self.clip_path, self.clip_start, self.clip_end)
+        self.clip_path = None
+        self.clip_start = None
+        self.clip_end = None
+
+    def close(self):
+        # Finish the clip in progress and stop the encoder thread
+        self.frames.put(None)
+        self.thread.join(timeout=10.0)
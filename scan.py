@@ -0,0 +1,224 @@
+# Offline motion scan of recorded video, faster than real time on a process pool.
+#   python -m scan recordings/ --sample-fps 5 --output timeline.json
+#   python -m scan recordings/ --output timeline.db
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+import cv2
+
+from background import BACKGROUND_MODELS
+from detector import MotionDetector
+from events import MotionEventEmitter
+from zones import DetectionZones, ZoneStore
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".m4v", ".ts", ".webm")
+
+
+def find_videos(paths):
+    # Files are taken as they are, directories are searched for video files
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        videos.append(os.path.join(directory, name))
+        else:
+            videos.append(path)
+    return videos
+
+
+def plan_ranges(path, chunk_seconds):
+    # Split a file into (path, first frame, end frame, fps) ranges of about chunk_seconds each
+    video = cv2.VideoCapture(path)
+    try:
+        if not video.isOpened():
+            return []
+        fps = video.get(cv2.CAP_PROP_FPS)
+        frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        video.release()
+    if not 0 < fps < 240:
+        fps = 30.0
+    if frames <= 0:
+        # Some containers don't know their length, scan them in one piece
+        return [(path, 0, None, fps)]
+    chunk = max(1, int(chunk_seconds * fps))
+    return [(path, start, min(start + chunk, frames), fps) for start in range(0, frames, chunk)]
+
+
+def scan_range(job):
+    # Runs in a worker process: scan one range of one file and return its motion intervals
+    (path, first, end, fps), settings = job
+    cv2.setNumThreads(1)
+    detector = MotionDetector(
+        delta_threshold=settings["threshold"],
+        min_area=settings["min_area"],
+        scale=settings["scale"],
+        background=settings["background"],
+        gate=settings["gate"],
+    )
+    if settings["zones"]:
+        detector.set_zones(DetectionZones(settings["zones"]))
+    intervals = []
+    emitter = MotionEventEmitter(path, cooldown=settings["cooldown"], sink=intervals.append)
+
+    # Only every step-th frame is retrieved and checked, the others are just grabbed, which skips
+    # the color conversion and copy (the decoder still has to see every frame of a compressed stream)
+    step = max(1, int(round(fps / settings["sample_fps"]))) if settings["sample_fps"] else 1
+
+    # Start a few samples early so the background model has settled by the first frame of the range
+    index = max(0, first - step * settings["warmup"])
+    video = cv2.VideoCapture(path)
+    started = time.perf_counter()
+    decoded = 0
+    try:
+        if index:
+            video.set(cv2.CAP_PROP_POS_FRAMES, index)
+        while end is None or index < end:
+            if index % step:
+                if not video.grab():
+                    break
+            else:
+                ret, frame = video.read()
+                if not ret:
+                    break
+                decoded += 1
+                boxes = detector.detect(frame)
+                if index >= first:
+                    emitter.update(boxes, index / fps)
+            index += 1
+    finally:
+        emitter.finish()
+        video.release()
+
+    return {
+        "path": path,
+        "fps": fps,
+        "first": first,
+        "frames": index - first,
+        "decoded": decoded,
+        "seconds": time.perf_counter() - started,
+        "intervals": [
+            {"start": event["start_ts"], "end": event["end_ts"], "peak_area": event["peak_area"], "boxes": event["boxes"]}
+            for event in intervals if event["type"] == "motion_end"
+        ],
+    }
+
+
+def merge_intervals(intervals, gap):
+    # Join intervals split by a range boundary, or closer together than the cooldown
+    merged = []
+    for interval in sorted(intervals, key=lambda item: item["start"]):
+        if merged and interval["start"] - merged[-1]["end"] <= gap:
+            last = merged[-1]
+            last["end"] = max(last["end"], interval["end"])
+            if interval["peak_area"] > last["peak_area"]:
+                last["peak_area"] = interval["peak_area"]
+                last["boxes"] = interval["boxes"]
+        else:
+            merged.append(dict(interval))
+    return merged
+
+
+def write_json(path, timeline):
+    with open(path, "w") as output:
+        json.dump(timeline, output, indent=2)
+
+
+def write_sqlite(path, timeline):
+    # One row per interval, times in seconds from the start of the file; rescanning a file replaces its rows
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS scan_intervals (
+                    id INTEGER PRIMARY KEY,
+                    file TEXT NOT NULL,
+                    start_s REAL NOT NULL,
+                    end_s REAL NOT NULL,
+                    peak_area INTEGER,
+                    boxes TEXT
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS scan_intervals_file ON scan_intervals (file, start_s)")
+            for file, intervals in timeline.items():
+                connection.execute("DELETE FROM scan_intervals WHERE file = ?", (file,))
+                connection.executemany(
+                    "INSERT INTO scan_intervals (file, start_s, end_s, peak_area, boxes) VALUES (?, ?, ?, ?, ?)",
+                    [(file, item["start"], item["end"], item["peak_area"], json.dumps(item["boxes"])) for item in intervals],
+                )
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan recorded video for motion, several files and ranges at a time.")
+    parser.add_argument("paths", nargs="+", help="video files or directories of recordings")
+    parser.add_argument("--output", default=None, help="write the timeline to this .json or .db file (default: print it)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--sample-fps", type=float, default=5.0, help="frames per second to decode and check, 0 for every frame")
+    parser.add_argument("--chunk-seconds", type=float, default=600.0, help="length of the ranges long files are split into")
+    parser.add_argument("--min-area", type=int, default=500, help="minimum contour area in pixels")
+    parser.add_argument("--threshold", type=int, default=30, help="pixel difference threshold")
+    parser.add_argument("--cooldown", type=float, default=2.0, help="seconds without motion that end an interval")
+    parser.add_argument("--scale", type=float, default=0.5, help="detection scale")
+    parser.add_argument("--no-gate", action="store_true", help="run the full pipeline on every sampled frame")
+    parser.add_argument("--background", choices=sorted(BACKGROUND_MODELS), default="prev", help="background model")
+    parser.add_argument("--zones-db", default=None, help="apply the detection zones stored in this database for --camera")
+    parser.add_argument("--camera", default=None, help="camera the recordings are from, its zones are used with --zones-db")
+    args = parser.parse_args(argv)
+    if args.zones_db and args.camera is None:
+        parser.error("--zones-db needs --camera")
+
+    settings = {
+        "threshold": args.threshold,
+        "min_area": args.min_area,
+        "scale": args.scale,
+        "background": args.background,
+        "gate": not args.no_gate,
+        "cooldown": args.cooldown,
+        "sample_fps": args.sample_fps,
+        "warmup": 5,
+        "zones": ZoneStore(args.zones_db).load(args.camera) if args.zones_db else [],
+    }
+
+    videos = find_videos(args.paths)
+    jobs = [(job, settings) for path in videos for job in plan_ranges(path, args.chunk_seconds)]
+    if not jobs:
+        parser.error("no readable video files found")
+
+    # Hand out the longest ranges first so one big file doesn't finish last on its own
+    jobs.sort(key=lambda job: -(job[0][2] - job[0][1]) if job[0][2] is not None else 0)
+
+    started = time.perf_counter()
+    intervals = {path: [] for path in videos}
+    frames = 0
+    video_seconds = 0.0
+    with multiprocessing.Pool(args.workers) as pool:
+        for result in pool.imap_unordered(scan_range, jobs):
+            intervals[result["path"]].extend(result["intervals"])
+            frames += result["frames"]
+            video_seconds += result["frames"] / result["fps"]
+    elapsed = time.perf_counter() - started
+
+    timeline = {path: merge_intervals(items, args.cooldown) for path, items in intervals.items()}
+    if args.output is None:
+        print(json.dumps(timeline, indent=2))
+    elif args.output.endswith((".db", ".sqlite")):
+        write_sqlite(args.output, timeline)
+    else:
+        write_json(args.output, timeline)
+
+    sys.stderr.write("Scanned %d files, %d frames (%.0f s of video) in %.1f s, %.0fx real time" % (
+        len(videos), frames, video_seconds, elapsed, video_seconds / elapsed if elapsed else 0.0))
+    sys.stderr.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import time
+
+# Load shedding steps as (render every Nth frame, detect every Nth frame), from no shedding to the most
+SHED_LEVELS = [(1, 1), (2, 1), (4, 1), (4, 2), (4, 4)]
+
+
+class FramePacer:
+    def __init__(self, fps=0.0, default_fps=30.0, high_load=0.9, low_load=0.5):
+        # Expected time between camera frames, taken from CAP_PROP_FPS or measured from the frames
+        self.default_interval = 1.0 / default_fps
+        self.interval = None
+        self.set_fps(fps)
+
+        # Processing time as a share of the frame interval above which we shed load, and below which we recover
+        self.high_load = high_load
+        self.low_load = low_load
+
+        self.level = 0
+        self.frame_number = 0
+        self.processing_time = 0.0
+        self.last_timestamp = None
+        self.measured_interval = None
+        self.last_change = 0
+
+        # Effective rates over the last second
+        self.detect_fps = 0.0
+        self.render_fps = 0.0
+        self.window_start = time.monotonic()
+        self.window_detected = 0
+        self.window_rendered = 0
+
+    def set_fps(self, fps):
+        # Cameras that do not know their frame rate report 0, the interval is then measured instead
+        self.interval = 1.0 / fps if 0 < fps < 240 else None
+
+    def frame_interval(self):
+        if self.interval is not None:
+            return self.interval
+        if self.measured_interval is not None:
+            return self.measured_interval
+        return self.default_interval
+
+    def start_frame(self, timestamp):
+        # Decide what to do with a new frame, returns (detect, render)
+        if self.last_timestamp is not None and timestamp > self.last_timestamp:
+            # Keep a smoothed estimate of the real frame interval
+            gap = timestamp - self.last_timestamp
+            if self.measured_interval is None:
+                self.measured_interval = gap
+            else:
+                self.measured_interval += 0.1 * (gap - self.measured_interval)
+        self.last_timestamp = timestamp
+
+        self.frame_number += 1
+        render_every, detect_every = SHED_LEVELS[self.level]
+        return self.frame_number % detect_every == 0, self.frame_number % render_every == 0
+
+    def finish_frame(self, elapsed, detected, rendered):
+        # Track how long frames take to process and shed or restore load accordingly
+        self.processing_time += 0.2 * (elapsed - self.processing_time)
+        load = self.processing_time / self.frame_interval()
+
+        # Wait a few frames after a change so the average can settle
+        if self.frame_number - self.last_change >= 10:
+            if load > self.high_load and self.level < len(SHED_LEVELS) - 1:
+                self.level += 1
+                self.last_change = self.frame_number
+            elif load < self.low_load and self.level > 0:
+                self.level -= 1
+                self.last_change = self.frame_number
+
+        self.window_detected += detected
+        self.window_rendered += rendered
+        now = time.monotonic()
+        if now - self.window_start >= 1.0:
+            self.detect_fps = self.window_detected / (now - self.window_start)
+            self.render_fps = self.window_rendered / (now - self.window_start)
+            self.window_start = now
+            self.window_detected = 0
+            self.window_rendered = 0
+
+    def next_delay_ms(self, got_frame):
+        # Wake up when the next camera frame should be ready instead of polling at a fixed rate
+        interval = self.frame_interval()
+        if not got_frame or self.last_timestamp is None:
+            # Nothing new yet, look again a little later
+            return max(1, int(interval * 250))
+        due = self.last_timestamp + interval - time.monotonic()
+        return max(1, int(due * 1000))
+
+    def metric_values(self):
+        # Gauges for metrics.PipelineMetrics.add_collector()
+        return {
+            "detect_fps": ("gauge", "Frames run through detection per second.", "%.2f" % self.detect_fps),
+            "render_fps": ("gauge", "Frames drawn per second.", "%.2f" % self.render_fps),
+            "load_shedding_level": ("gauge", "How far render and detection are being thinned out, 0 is none.", self.level),
+        }
+
+    def overloaded(self):
+        return self.level > 0
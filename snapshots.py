@@ -0,0 +1,277 @@
+# Stills of motion events: a JPEG of the annotated frame and a small thumbnail, stored under the hash
+# of their content and indexed in SQLite, with an LRU cache of decoded thumbnails for the screens.
+# List the newest snapshots with: python -m snapshots --camera 0
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Stored paths look like "ab/cdef...jpg", the first two hex digits of the SHA-256 are the directory
+STORED_PATH = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{62}\.jpg$")
+
+
+class ThumbnailCache:
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        # Stored path -> (JPEG bytes, decoded BGR image), least recently used first.
+        # Both are kept so the GUI gets the image and the stream server the bytes without touching the disk.
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        # Returns the cached entry, or calls load(key) and caches what it returns (None is not cached)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Read and decode outside the lock, two threads missing the same key at once just both load it
+        entry = load(key)
+        if entry is not None:
+            self.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self.entry_bytes(previous)
+            self.entries[key] = entry
+            self.bytes += self.entry_bytes(entry)
+
+            # Drop the least recently used thumbnails until the cache fits, always keeping the newest
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self.entry_bytes(evicted)
+                self.evictions += 1
+
+    def entry_bytes(self, entry):
+        data, image = entry
+        return len(data) + image.nbytes
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def metric_values(self):
+        # Counters for metrics.PipelineMetrics.add_collector()
+        return {
+            "snapshot_cache_hits_total": ("counter", "Thumbnail lookups served from memory.", self.hits),
+            "snapshot_cache_misses_total": ("counter", "Thumbnail lookups that read and decoded the file.", self.misses),
+            "snapshot_cache_evictions_total": ("counter", "Thumbnails dropped to stay within the memory limit.", self.evictions),
+            "snapshot_cache_hit_ratio": ("gauge", "Share of thumbnail lookups served from memory.", self.hit_rate()),
+            "snapshot_cache_bytes": ("gauge", "Memory used by cached thumbnails, encoded and decoded.", self.bytes),
+            "snapshot_cache_entries": ("gauge", "Thumbnails in the cache.", len(self.entries)),
+        }
+
+
+class SnapshotStore:
+    def __init__(self, directory="snapshots", database="HomeSecurity.db", quality=85, thumbnail_width=160,
+                 cache_bytes=8 * 1024 * 1024, box_color=(0, 255, 0)):
+        self.directory = directory
+        self.database = database
+        self.quality = quality
+        self.thumbnail_width = thumbnail_width
+        self.box_color = box_color
+
+        # Decoded thumbnails of recent snapshots, shared by the GUI and the stream server
+        self.cache = ThumbnailCache(cache_bytes)
+
+        # Encoding and writing run on one worker thread so add() never holds up the capture loop
+        self.worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.local = threading.local()
+
+        # Thumbnail of the newest snapshot per camera as (timestamp, stored path), for linking it to its event
+        self.latest = {}
+
+        # Counters: snapshots stored, and files that already existed because the content was the same
+        self.written_count = 0
+        self.duplicate_count = 0
+
+        # Create the directory and the index before anything can query it
+        os.makedirs(directory, exist_ok=True)
+        connection = self.connect()
+        with connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY,
+                    camera TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    image TEXT NOT NULL,
+                    thumbnail TEXT NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    boxes TEXT
+                );
+                CREATE INDEX IF NOT EXISTS snapshots_camera_ts ON snapshots (camera, ts);
+                CREATE INDEX IF NOT EXISTS snapshots_ts ON snapshots (ts);
+            """)
+
+    def connect(self):
+        # SQLite connections can't be shared between threads, each thread gets its own
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, timeout=30.0)
+            self.local.connection = connection
+        return connection
+
+    def add(self, camera, timestamp, frame, boxes):
+        # Queue a snapshot of the frame with the boxes drawn on it, returns a concurrent.futures.Future.
+        # The frame is only read on the worker thread, the capture side hands over a new array every frame.
+        return self.worker.submit(self.save, str(camera), timestamp, frame, [tuple(box) for box in boxes])
+
+    def save(self, camera, timestamp, frame, boxes):
+        # Runs on the worker thread: draw the boxes, encode both sizes, store them and index the snapshot
+        height, width = frame.shape[:2]
+
+        # Shrink the clean frame for the thumbnail and draw the boxes on it afterwards, so they stay visible.
+        # INTER_AREA is slower than the linear resize used for detection, but this runs once per event.
+        scale = min(1.0, self.thumbnail_width / float(width))
+        thumbnail = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        image = frame.copy()
+        for (x, y, w, h) in boxes:
+            cv2.rectangle(image, (x, y), (x + w, y + h), self.box_color, 2)
+            x0, y0 = int(x * scale), int(y * scale)
+            cv2.rectangle(thumbnail, (x0, y0), (x0 + int(w * scale), y0 + int(h * scale)), self.box_color, 1)
+
+        image_path = self.write_file(self.encode(image))
+        thumbnail_data = self.encode(thumbnail)
+        thumbnail_path = self.write_file(thumbnail_data)
+
+        # A new snapshot is the most likely one to be looked at next, so it goes straight into the cache
+        self.cache.put(thumbnail_path, (thumbnail_data, thumbnail))
+
+        connection = self.connect()
+        with connection:
+            connection.execute(
+                "INSERT INTO snapshots (camera, ts, image, thumbnail, width, height, boxes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (camera, timestamp, image_path, thumbnail_path, width, height, json.dumps([list(box) for box in boxes])),
+            )
+        self.latest[camera] = (timestamp, thumbnail_path)
+        self.written_count += 1
+        return {"camera": camera, "ts": timestamp, "image": image_path, "thumbnail": thumbnail_path}
+
+    def encode(self, image):
+        ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("could not encode the snapshot")
+        return data.tobytes()
+
+    def write_file(self, data):
+        # Store the JPEG under its SHA-256 and return the stored path. Identical content is written once,
+        # and a file is renamed into place only when complete, so a stored path always names a whole image.
+        digest = hashlib.sha256(data).hexdigest()
+        stored = "%s/%s.jpg" % (digest[:2], digest[2:])
+        path = self.file_path(stored)
+        if os.path.exists(path):
+            self.duplicate_count += 1
+            return stored
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = "%s.%d.tmp" % (path, threading.get_ident())
+        with open(temporary, "wb") as output:
+            output.write(data)
+        os.replace(temporary, path)
+        return stored
+
+    def file_path(self, stored):
+        # Stored paths come from the database or a URL, anything that isn't a content hash is refused
+        if not STORED_PATH.match(stored):
+            raise ValueError("not a snapshot path: %r" % stored)
+        return os.path.join(self.directory, *stored.split("/"))
+
+    def read(self, stored):
+        # JPEG bytes of a stored image, or None if it isn't there
+        try:
+            with open(self.file_path(stored), "rb") as source:
+                return source.read()
+        except (OSError, ValueError):
+            return None
+
+    def load_thumbnail(self, stored):
+        data = self.read(stored)
+        if data is None:
+            return None
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        return data, image
+
+    def thumbnail(self, stored):
+        # (JPEG bytes, decoded BGR image) of a thumbnail, from the cache when possible, or None
+        return self.cache.get(stored, self.load_thumbnail)
+
+    def thumbnail_for(self, camera, timestamp):
+        # Thumbnail of the snapshot taken when the camera's event started, None if it isn't written yet
+        latest = self.latest.get(str(camera))
+        if latest is not None and latest[0] == timestamp:
+            return latest[1]
+        return None
+
+    def recent(self, camera=None, limit=20):
+        # Newest snapshots first
+        where = ""
+        params = []
+        if camera is not None:
+            where = " WHERE camera = ?"
+            params.append(str(camera))
+        params.append(limit)
+        cursor = self.connect().execute(
+            "SELECT id, camera, ts, image, thumbnail, width, height, boxes FROM snapshots" + where + " ORDER BY ts DESC LIMIT ?",
+            params,
+        )
+        columns = [column[0] for column in cursor.description]
+        rows = []
+        for row in cursor:
+            snapshot = dict(zip(columns, row))
+            snapshot["boxes"] = json.loads(snapshot["boxes"]) if snapshot["boxes"] else []
+            rows.append(snapshot)
+        return rows
+
+    def metric_values(self):
+        # Counters for metrics.PipelineMetrics.add_collector(), including the thumbnail cache
+        values = {
+            "snapshots_written_total": ("counter", "Motion event snapshots stored.", self.written_count),
+            "snapshot_duplicate_files_total": ("counter", "Snapshot files not written again because the content was already stored.", self.duplicate_count),
+        }
+        values.update(self.cache.metric_values())
+        return values
+
+    def close(self):
+        # Finish the snapshots still being written
+        self.worker.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List stored motion event snapshots.")
+    parser.add_argument("--db", default="HomeSecurity.db", help="database file")
+    parser.add_argument("--directory", default="snapshots", help="snapshot directory")
+    parser.add_argument("--camera", default=None, help="only show snapshots from this camera")
+    parser.add_argument("--limit", type=int, default=20, help="maximum number of snapshots")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.directory, args.db)
+    for snapshot in store.recent(args.camera, args.limit):
+        snapshot["time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot["ts"]))
+        print(json.dumps(snapshot))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
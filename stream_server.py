@@ -0,0 +1,307 @@
+# MJPEG streaming of the annotated video to browsers.
+# Open http://host:8080/ for a page with the live video, or use /stream?width=320&fps=5 directly.
+# With a snapshot store, /events shows the thumbnails of the latest motion events.
+import asyncio
+import concurrent.futures
+import html
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import cv2
+
+BOUNDARY = "frame"
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>HomeSecurity</title></head>
+<body style="margin:0;background:#000"><img src="/stream%s" style="width:100%%"></body></html>
+"""
+
+EVENTS_PAGE = """<!DOCTYPE html>
+<html><head><title>HomeSecurity events</title></head>
+<body style="font-family:sans-serif">%s</body></html>
+"""
+
+EVENT_ITEM = """<a href="/snapshots/%s%s" style="display:inline-block;margin:4px;text-align:center">\
+<img src="/thumbnails/%s%s"><br>%s %s</a>
+"""
+
+
+class StreamClient:
+    def __init__(self, width, fps):
+        # Requested frame width (0 for full size) and frame rate limit (0 for every frame)
+        self.width = width
+        self.fps = fps
+
+
+class MJPEGServer:
+    def __init__(self, port=8080, host="127.0.0.1", quality=80, box_color=(0, 255, 0), snapshots=None,
+                 check_session=None):
+        self.port = port
+        self.host = host
+        self.quality = quality
+        self.box_color = box_color
+
+        # Optional snapshots.SnapshotStore for the event pages, thumbnails come from its cache
+        self.snapshots = snapshots
+
+        # Called with the ?token= of every request, which is refused when it returns None, e.g.
+        # credentials.CredentialStore.check_session. Without it anyone who can reach the port can watch.
+        self.check_session = check_session
+        self.refused_count = 0
+
+        # Newest frame handed over by the capture side, picked up by the encoder
+        self.lock = threading.Lock()
+        self.pending = None
+        self.encoding = False
+
+        # Newest JPEGs, one per requested width, shared by every client that asked for that width
+        self.sequence = 0
+        self.jpegs = {}
+        self.frame_size = None
+        self.frame_event = None
+        self.clients = set()
+
+        # Counters: frames encoded, sent to clients, and skipped because a client was still busy
+        self.encode_count = 0
+        self.sent_count = 0
+        self.skipped_count = 0
+
+        # The asyncio loop serves the clients on its own thread, JPEG encoding runs on one worker thread
+        self.loop = asyncio.new_event_loop()
+        self.encoder = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.server = None
+        self.thread = None
+
+        # Error from opening the port on the server thread, raised again by start()
+        self.error = None
+
+    def start(self):
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.serve, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+        if self.error is not None:
+            # The port couldn't be opened, e.g. it is already in use
+            self.thread.join()
+            self.thread = None
+            self.encoder.shutdown(wait=False)
+            raise self.error
+        return self
+
+    def serve(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.frame_event = asyncio.Event()
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        except Exception as error:
+            self.error = error
+            self.loop.close()
+            return
+        finally:
+            started.set()
+        self.loop.run_forever()
+
+        # Shut down: stop accepting, drop the clients and close the loop
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def stop(self):
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        self.encoder.shutdown(wait=False)
+
+    def publish(self, frame, boxes=()):
+        # Called for every frame from the capture side, never blocks; nothing is encoded without viewers
+        if not self.clients:
+            return
+        with self.lock:
+            self.pending = (frame, list(boxes))
+        self.loop.call_soon_threadsafe(self.start_encoding)
+
+    def start_encoding(self):
+        # Runs on the loop: one encode at a time, frames arriving meanwhile replace each other
+        if not self.encoding:
+            self.encoding = True
+            self.loop.create_task(self.encode_pending())
+
+    async def encode_pending(self):
+        try:
+            while True:
+                with self.lock:
+                    item, self.pending = self.pending, None
+                if item is None or not self.clients:
+                    break
+                widths = {client.width for client in self.clients}
+                self.jpegs = await self.loop.run_in_executor(self.encoder, self.encode, item[0], item[1], widths)
+                self.frame_size = item[0].shape[1::-1]
+                self.sequence += 1
+
+                # Wake every client waiting for a frame
+                event, self.frame_event = self.frame_event, asyncio.Event()
+                event.set()
+        finally:
+            self.encoding = False
+
+    def encode(self, frame, boxes, widths):
+        # Runs on the encoder thread: draw the boxes and encode once per requested width
+        jpegs = {}
+        height, width = frame.shape[:2]
+        for target in sorted(widths):
+            if target and target < width:
+                scale = target / float(width)
+                image = cv2.resize(frame, (target, max(1, int(height * scale))), interpolation=cv2.INTER_LINEAR)
+            else:
+                scale = 1.0
+                image = frame.copy()
+            for (x, y, w, h) in boxes:
+                x0, y0 = int(x * scale), int(y * scale)
+                cv2.rectangle(image, (x0, y0), (x0 + int(w * scale), y0 + int(h * scale)), self.box_color, 2)
+            ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if ok:
+                jpegs[target] = data.tobytes()
+        self.encode_count += 1
+        return jpegs
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # Skip the headers, nothing in them matters here
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self.respond(writer, "405 Method Not Allowed", "text/plain", b"GET only\n")
+                return
+            url = urlsplit(parts[1])
+            query = parse_qs(url.query)
+            width = self.query_number(query, "width", int)
+            fps = self.query_number(query, "fps", float)
+            token = query.get("token", [""])[0]
+            if self.check_session is not None and (not token or self.check_session(token) is None):
+                # Sessions are checked in memory, nothing is hashed per request
+                self.refused_count += 1
+                await self.respond(writer, "401 Unauthorized", "text/plain", b"Log in to the app and open the link it shows\n")
+                return
+            # Pages pass the token on to the images they link to
+            suffix = "?" + urlencode({"token": token}) if token else ""
+            if url.path == "/":
+                await self.respond(writer, "200 OK", "text/html", (PAGE % suffix).encode("utf-8"))
+            elif url.path == "/stream":
+                await self.stream(writer, StreamClient(width, fps))
+            elif url.path == "/snapshot.jpg":
+                await self.snapshot(writer, width)
+            elif self.snapshots is not None and url.path == "/events":
+                await self.events(writer, suffix)
+            elif self.snapshots is not None and url.path.startswith(("/thumbnails/", "/snapshots/")):
+                await self.stored_image(writer, url.path)
+            else:
+                await self.respond(writer, "404 Not Found", "text/plain", b"Not found\n")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    def query_number(self, query, name, kind):
+        # Missing or invalid values mean "no limit"
+        try:
+            return max(0, kind(query[name][0]))
+        except (KeyError, ValueError):
+            return 0
+
+    def normalize_width(self, width):
+        # Widths are rounded to steps of 80 pixels so clients asking for similar sizes share one encode
+        if not width:
+            return 0
+        width = max(80, width // 80 * 80)
+        if self.frame_size is not None and width >= self.frame_size[0]:
+            return 0
+        return width
+
+    async def respond(self, writer, status, content_type, body):
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (
+            status, content_type, len(body))).encode("latin-1") + body)
+        await writer.drain()
+
+    async def next_jpeg(self, client, last_sequence):
+        # Wait for a frame newer than the one the client has, in the client's size
+        self.clients.add(client)
+        while self.sequence == last_sequence or client.width not in self.jpegs:
+            await self.frame_event.wait()
+        return self.sequence, self.jpegs[client.width]
+
+    async def snapshot(self, writer, width):
+        client = StreamClient(self.normalize_width(width), 0)
+        try:
+            _, jpeg = await asyncio.wait_for(self.next_jpeg(client, -1), 5.0)
+        except asyncio.TimeoutError:
+            await self.respond(writer, "503 Service Unavailable", "text/plain", b"No frames\n")
+            return
+        finally:
+            self.clients.discard(client)
+        await self.respond(writer, "200 OK", "image/jpeg", jpeg)
+
+    async def events(self, writer, suffix):
+        # Page of the latest snapshots, the database is read on the encoder thread to keep the loop free
+        rows = await self.loop.run_in_executor(self.encoder, self.snapshots.recent, None, 48)
+        items = "".join(EVENT_ITEM % (row["image"], suffix, row["thumbnail"], suffix, html.escape(row["camera"]),
+                                      time.strftime("%H:%M:%S", time.localtime(row["ts"]))) for row in rows)
+        await self.respond(writer, "200 OK", "text/html; charset=utf-8", (EVENTS_PAGE % (items or "No events yet")).encode("utf-8"))
+
+    async def stored_image(self, writer, path):
+        # Thumbnails are served from the cache, full size snapshots straight from their file
+        kind, _, stored = path[1:].partition("/")
+        if kind == "thumbnails":
+            entry = await self.loop.run_in_executor(self.encoder, self.snapshots.thumbnail, stored)
+            data = entry[0] if entry is not None else None
+        else:
+            data = await self.loop.run_in_executor(self.encoder, self.snapshots.read, stored)
+        if data is None:
+            await self.respond(writer, "404 Not Found", "text/plain", b"Not found\n")
+            return
+        await self.respond(writer, "200 OK", "image/jpeg", data)
+
+    async def stream(self, writer, client):
+        client.width = self.normalize_width(client.width)
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=%s\r\n"
+                      "Cache-Control: no-cache\r\nConnection: close\r\n\r\n" % BOUNDARY).encode("latin-1"))
+        # Keep at most about one frame queued in the socket, a slow client then gets the newest frame when it catches up
+        writer.transport.set_write_buffer_limits(high=16384)
+        sequence = 0
+        next_time = 0.0
+        try:
+            while True:
+                if client.fps:
+                    # Honour the client's frame rate limit by waiting before picking up the next frame
+                    delay = next_time - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    next_time = max(next_time + 1.0 / client.fps, time.monotonic())
+                previous = sequence
+                sequence, jpeg = await self.next_jpeg(client, sequence)
+                if previous:
+                    self.skipped_count += sequence - previous - 1
+                writer.write(("--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % (BOUNDARY, len(jpeg))).encode("latin-1"))
+                writer.write(jpeg)
+                writer.write(b"\r\n")
+                await writer.drain()
+                self.sent_count += 1
+        finally:
+            self.clients.discard(client)
+
+    def metric_values(self):
+        # Counters for metrics.PipelineMetrics.add_collector()
+        return {
+            "stream_clients": ("gauge", "Browsers watching the MJPEG stream.", len(self.clients)),
+            "stream_encodes_total": ("counter", "Frames JPEG encoded for the stream, once for all clients.", self.encode_count),
+            "stream_frames_sent_total": ("counter", "Frames sent to stream clients.", self.sent_count),
+            "stream_frames_skipped_total": ("counter", "Frames a slow or rate limited client never got.", self.skipped_count),
+            "stream_requests_refused_total": ("counter", "Requests without a valid session token.", self.refused_count),
+        }
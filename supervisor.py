@@ -0,0 +1,284 @@
+# Multi-camera supervisor, run with: python -m supervisor 0 1 rtsp://camera/stream
+import argparse
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import time
+
+import cv2
+
+from background import BACKGROUND_MODELS
+from capture import camera_name, parse_source
+from detector import MotionDetector
+from events import EventStore, MotionEventEmitter
+from motion_daemon import process
+from zones import DetectionZones, ZoneStore
+
+logger = logging.getLogger("supervisor")
+
+# Thumbnails are sent as small JPEGs to keep the messages compact
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_QUALITY = 70
+
+# Seconds a restarted worker must keep sending heartbeats before its restart backoff starts over,
+# longer than the longest backoff so a worker that keeps crashing still backs off
+HEALTHY_SECONDS = 120.0
+
+
+def encode_thumbnail(frame, width=THUMBNAIL_WIDTH):
+    # Shrink the frame and encode it as JPEG bytes
+    height = max(1, frame.shape[0] * width // frame.shape[1])
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return data.tobytes() if ok else None
+
+
+def worker_main(camera, source, messages, settings, zones):
+    # messages is the sending end of the worker's own pipe to the supervisor, zones the camera's detection zones
+    # Keep OpenCV to one thread per worker, the supervisor scales by running one process per camera
+    cv2.setNumThreads(1)
+
+    detector = MotionDetector(delta_threshold=settings["threshold"], min_area=settings["min_area"], scale=settings["scale"], background=settings["background"], gate=settings["gate"])
+    if zones:
+        detector.set_zones(DetectionZones(zones))
+    emitter = MotionEventEmitter(camera, cooldown=settings["cooldown"], sink=lambda event: messages.send(("event", camera, event)))
+
+    last_heartbeat = 0.0
+    last_preview = 0.0
+
+    def heartbeat():
+        # Let the supervisor know the worker is alive. It is also sent while the camera has no frames,
+        # the capture thread reconnects a stalled camera on its own and the worker must not be killed meanwhile.
+        nonlocal last_heartbeat
+        now = time.time()
+        if now - last_heartbeat >= 1.0:
+            messages.send(("heartbeat", camera, now))
+            last_heartbeat = now
+
+    def report(frame, timestamp, started):
+        nonlocal last_preview
+        heartbeat()
+        now = time.time()
+        if started or now - last_preview >= settings["preview_interval"]:
+            # Send a thumbnail of the frame that started a motion event, and now and then refresh the preview of an idle camera
+            messages.send(("thumbnail", camera, encode_thumbnail(frame)))
+            last_preview = now
+
+    process(source, detector, emitter, on_frame=report, on_wait=heartbeat)
+
+
+class CameraWorker:
+    def __init__(self, camera, source, settings, zones=()):
+        self.camera = camera
+        self.source = source
+        self.settings = settings
+        self.zones = list(zones)
+
+        # Receiving end of the pipe the current process reports through. Every process gets a pipe of its own,
+        # terminating a hung worker halfway through a message can only break its own pipe, never another camera's.
+        self.connection = None
+
+        self.process = None
+        self.last_heartbeat = 0.0
+        self.restart_count = 0
+        self.restart_at = 0.0
+        self.started_at = 0.0
+        self.finished = False
+
+    def start(self):
+        self.close_connection()
+        self.connection, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=worker_main,
+            args=(self.camera, self.source, sender, self.settings, self.zones),
+            name="camera-%s" % self.camera,
+            daemon=True,
+        )
+        self.process.start()
+        # Only the worker writes to the pipe, closing this end lets the supervisor see when the worker is gone
+        sender.close()
+        self.started_at = time.time()
+        # Give the worker time to open the source before it counts as hung
+        self.last_heartbeat = time.time() + self.settings["startup_grace"]
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=2.0)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        self.close_connection()
+
+    def close_connection(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def heartbeat(self, timestamp):
+        self.last_heartbeat = timestamp
+        # After a healthy stretch, an occasional crash restarts after the shortest delay again
+        if self.restart_count and timestamp - self.started_at >= HEALTHY_SECONDS:
+            self.restart_count = 0
+
+    def schedule_restart(self, now):
+        # Back off exponentially when a worker keeps failing, capped at one minute
+        delay = min(60.0, 2.0 ** min(self.restart_count, 6))
+        self.restart_count += 1
+        self.restart_at = now + delay
+        self.process = None
+        return delay
+
+
+class Supervisor:
+    def __init__(self, sources, on_message=None, min_area=500, threshold=30, cooldown=2.0, scale=1.0, background="prev", gate=True,
+                 hang_timeout=10.0, startup_grace=10.0, preview_interval=5.0, event_store=None, zone_store=None):
+        self.settings = {
+            "min_area": min_area,
+            "threshold": threshold,
+            "cooldown": cooldown,
+            "scale": scale,
+            "background": background,
+            "gate": gate,
+            "startup_grace": startup_grace,
+            "preview_interval": preview_interval,
+        }
+        self.hang_timeout = hang_timeout
+        self.on_message = on_message or log_message
+
+        # Only the supervisor process writes to the database, workers just send their events
+        self.event_store = event_store
+
+        # Create one worker per source, cameras are named by their position in the list.
+        # Zones are looked up by the name the GUI and the daemon give the source.
+        self.workers = {}
+        for index, source in enumerate(sources):
+            camera = str(index)
+            source = parse_source(source)
+            zones = zone_store.load(camera_name(source)) if zone_store is not None else []
+            self.workers[camera] = CameraWorker(camera, source, self.settings, zones)
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+    def running(self):
+        # The supervisor is done once every worker has finished its source
+        return not all(worker.finished for worker in self.workers.values())
+
+    def poll(self, timeout=0.0):
+        # Deliver the messages waiting in the workers' pipes, then check on the workers
+        deadline = time.time() + timeout
+        workers = {worker.connection: worker for worker in self.workers.values() if worker.connection is not None}
+        while workers:
+            ready = multiprocessing.connection.wait(list(workers), timeout=max(0.0, deadline - time.time()))
+            if not ready:
+                break
+            for connection in ready:
+                try:
+                    kind, camera, payload = connection.recv()
+                except (EOFError, OSError, pickle.UnpicklingError):
+                    # The worker is gone and everything it sent has been read, or it was killed halfway through a message
+                    workers.pop(connection).close_connection()
+                    continue
+                if kind == "heartbeat":
+                    self.workers[camera].heartbeat(payload)
+                    continue
+                if kind == "event" and self.event_store is not None:
+                    self.event_store.add_motion_end(payload)
+                self.on_message(kind, camera, payload)
+        self.check_workers()
+
+    def check_workers(self):
+        now = time.time()
+        for worker in self.workers.values():
+            if worker.finished:
+                continue
+
+            if worker.process is None:
+                # Waiting for a scheduled restart
+                if now >= worker.restart_at:
+                    logger.info("restarting camera %s", worker.camera)
+                    worker.start()
+                continue
+
+            if not worker.process.is_alive():
+                if worker.process.exitcode == 0:
+                    # The source ended normally (e.g. a video file)
+                    worker.finished = True
+                    continue
+                exitcode = worker.process.exitcode
+                delay = worker.schedule_restart(now)
+                logger.warning("camera %s exited with code %s, restarting in %.0fs", worker.camera, exitcode, delay)
+            elif now - worker.last_heartbeat > self.hang_timeout:
+                worker.stop()
+                delay = worker.schedule_restart(now)
+                logger.warning("camera %s stopped responding, restarting in %.0fs", worker.camera, delay)
+
+    def run(self):
+        self.start()
+        try:
+            while self.running():
+                self.poll(timeout=0.5)
+            # Pick up the last events from workers that finished
+            self.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def log_message(kind, camera, payload):
+    # Default handler: log events, ignore thumbnails
+    if kind == "event":
+        print(json.dumps(payload), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run motion detection on several cameras, one process per camera.")
+    parser.add_argument("sources", nargs="+", help="device indices, video files or stream URLs")
+    parser.add_argument("--min-area", type=int, default=500, help="minimum contour area in pixels")
+    parser.add_argument("--threshold", type=int, default=30, help="pixel difference threshold")
+    parser.add_argument("--cooldown", type=float, default=2.0, help="seconds without motion that end an event")
+    parser.add_argument("--scale", type=float, default=1.0, help="detection scale, e.g. 0.5 or 0.25 for large frames")
+    parser.add_argument("--no-gate", action="store_true", help="run the full pipeline on every frame, even when nothing changes")
+    parser.add_argument("--background", choices=sorted(BACKGROUND_MODELS), default="prev", help="background model")
+    parser.add_argument("--db", default=None, help="also store finished events in this SQLite database, and use the cameras' detection zones from it")
+    parser.add_argument("--gui", action="store_true", help="show a live thumbnail of every camera")
+    parser.add_argument("--hang-timeout", type=float, default=10.0, help="seconds without a heartbeat before a worker is restarted")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    supervisor = Supervisor(
+        args.sources,
+        min_area=args.min_area,
+        threshold=args.threshold,
+        cooldown=args.cooldown,
+        scale=args.scale,
+        background=args.background,
+        gate=not args.no_gate,
+        hang_timeout=args.hang_timeout,
+        event_store=EventStore(args.db) if args.db else None,
+        zone_store=ZoneStore(args.db) if args.db else None,
+    )
+
+    try:
+        if args.gui:
+            # Only pull in Tk and PIL when the thumbnail wall is wanted
+            from camera_wall import CameraWall
+            CameraWall(supervisor).run()
+        else:
+            supervisor.run()
+    finally:
+        if supervisor.event_store is not None:
+            supervisor.event_store.close()
+
+
+if __name__ == "__main__":
+    main()
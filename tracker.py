@@ -0,0 +1,157 @@
+import itertools
+from collections import deque
+
+import numpy as np
+
+
+def iou_matrix(a, b):
+    # Intersection over union of every box in a against every box in b, boxes are (x, y, w, h) rows
+    ax0, ay0 = a[:, 0:1], a[:, 1:2]
+    ax1, ay1 = ax0 + a[:, 2:3], ay0 + a[:, 3:4]
+    bx0, by0 = b[:, 0], b[:, 1]
+    bx1, by1 = bx0 + b[:, 2], by0 + b[:, 3]
+
+    inter_w = np.clip(np.minimum(ax1, bx1) - np.maximum(ax0, bx0), 0, None)
+    inter_h = np.clip(np.minimum(ay1, by1) - np.maximum(ay0, by0), 0, None)
+    inter = inter_w * inter_h
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def centroid_distance_matrix(a, b):
+    # Distance between the centers of every box in a and every box in b
+    ca = a[:, :2] + a[:, 2:] / 2.0
+    cb = b[:, :2] + b[:, 2:] / 2.0
+    return np.hypot(ca[:, 0:1] - cb[:, 0], ca[:, 1:2] - cb[:, 1])
+
+
+class Track:
+    def __init__(self, track_id, box, timestamp, path_length=64):
+        self.id = track_id
+        self.box = box
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+
+        # Frames with a matching box and frames in a row without one
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+
+        # Recent centers and the smoothed velocity in pixels per second
+        self.path = deque([(timestamp, self.center())], maxlen=path_length)
+        self.velocity = (0.0, 0.0)
+
+    def center(self):
+        x, y, w, h = self.box
+        return (x + w / 2.0, y + h / 2.0)
+
+    def dwell_time(self):
+        return self.last_seen - self.first_seen
+
+    def predicted_box(self, timestamp):
+        # Where the box should be now if it kept moving at the same speed
+        dt = timestamp - self.last_seen
+        x, y, w, h = self.box
+        return (x + self.velocity[0] * dt, y + self.velocity[1] * dt, w, h)
+
+    def update(self, box, timestamp):
+        prev_time, (prev_x, prev_y) = self.path[-1]
+        self.box = box
+        self.last_seen = timestamp
+        self.hits += 1
+        self.misses = 0
+
+        center = self.center()
+        dt = timestamp - prev_time
+        if dt > 0:
+            # Smooth the velocity so a single jittery box does not throw it off
+            vx = (center[0] - prev_x) / dt
+            vy = (center[1] - prev_y) / dt
+            self.velocity = (0.5 * self.velocity[0] + 0.5 * vx, 0.5 * self.velocity[1] + 0.5 * vy)
+        self.path.append((timestamp, center))
+
+
+class MotionTracker:
+    def __init__(self, min_iou=0.1, max_distance=80.0, birth_hits=3, coast_frames=10):
+        # Boxes match a track when they overlap enough or their centers are close enough
+        self.min_iou = min_iou
+        self.max_distance = max_distance
+
+        # A track is confirmed after birth_hits matches and dropped after coast_frames misses in a row
+        self.birth_hits = birth_hits
+        self.coast_frames = coast_frames
+
+        self.tracks = []
+        self.ids = itertools.count(1)
+
+        # Tracks confirmed and dropped during the last update
+        self.born = []
+        self.died = []
+
+    def update(self, boxes, timestamp):
+        self.born = []
+        self.died = []
+
+        matched_tracks = set()
+        matched_boxes = set()
+        if self.tracks and boxes:
+            # Score every track against every box in one go
+            predicted = np.array([track.predicted_box(timestamp) for track in self.tracks], dtype=np.float64)
+            current = np.array(boxes, dtype=np.float64)
+            iou = iou_matrix(predicted, current)
+            distance = centroid_distance_matrix(predicted, current)
+            score = iou + 0.5 * np.clip(1.0 - distance / self.max_distance, 0.0, None)
+            score[(iou < self.min_iou) & (distance > self.max_distance)] = -1.0
+
+            # Match every track and box that are each other's best choice, a whole batch per round.
+            # This gives the same pairs as greedy best-first matching in a few rounds instead of one per pair.
+            rows = np.arange(score.shape[0])
+            while True:
+                best_col = score.argmax(axis=1)
+                best_row = score.argmax(axis=0)
+                mutual = (best_row[best_col] == rows) & (score[rows, best_col] >= 0)
+                if not mutual.any():
+                    break
+                pair_rows = rows[mutual]
+                pair_cols = best_col[mutual]
+                for row, col in zip(pair_rows.tolist(), pair_cols.tolist()):
+                    self.tracks[row].update(boxes[col], timestamp)
+                matched_tracks.update(pair_rows.tolist())
+                matched_boxes.update(pair_cols.tolist())
+                score[pair_rows, :] = -1.0
+                score[:, pair_cols] = -1.0
+
+        # Count a miss for every track without a box and drop the ones that coasted too long
+        alive = []
+        for index, track in enumerate(self.tracks):
+            if index not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.coast_frames or not track.confirmed:
+                    if track.confirmed:
+                        self.died.append(track)
+                    continue
+            elif not track.confirmed and track.hits >= self.birth_hits:
+                track.confirmed = True
+                self.born.append(track)
+            alive.append(track)
+
+        # Start a tentative track for every unmatched box
+        for index, box in enumerate(boxes):
+            if index not in matched_boxes:
+                track = Track(next(self.ids), box, timestamp)
+                if self.birth_hits <= 1:
+                    track.confirmed = True
+                    self.born.append(track)
+                alive.append(track)
+
+        self.tracks = alive
+        return self.active_tracks()
+
+    def active_tracks(self):
+        # Confirmed tracks that were seen in the last update
+        return [track for track in self.tracks if track.confirmed and track.misses == 0]
+
+    def reset(self):
+        self.tracks = []
+        self.born = []
+        self.died = []
@@ -0,0 +1,115 @@
+from zones import EXCLUDE, INCLUDE, Zone, is_polygon
+
+ZONE_COLORS = {INCLUDE: "#00c0ff", EXCLUDE: "#ff4040"}
+HANDLE_RADIUS = 5
+
+
+class ZoneEditor:
+    def __init__(self, canvas, zones=None, on_change=None):
+        # Edits zones by clicking and dragging on the video canvas:
+        # left click adds a point, right click closes the polygon, dragging a point moves it
+        self.canvas = canvas
+        self.zones = list(zones or [])
+        self.on_change = on_change
+
+        self.kind = INCLUDE
+        self.editing = False
+        self.current = []
+        self.dragging = None
+
+    def frame_size(self):
+        # The canvas is sized to the video frame
+        return max(1, int(float(self.canvas.cget("width")))), max(1, int(float(self.canvas.cget("height"))))
+
+    def start(self, kind=INCLUDE):
+        if self.editing:
+            # Switching between include and exclude finishes the polygon being drawn
+            self.close_polygon()
+            self.kind = kind
+            self.redraw()
+            return
+        self.kind = kind
+        self.editing = True
+        self.canvas.bind("<ButtonPress-1>", self.on_press)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<ButtonPress-3>", self.close_polygon)
+        self.redraw()
+
+    def stop(self):
+        # Finish editing, hand the zones to the caller and hide the outlines
+        if not self.editing:
+            return
+        self.close_polygon()
+        self.editing = False
+        for sequence in ("<ButtonPress-1>", "<B1-Motion>", "<ButtonRelease-1>", "<ButtonPress-3>"):
+            self.canvas.unbind(sequence)
+        self.canvas.delete("zone")
+        if self.on_change is not None:
+            self.on_change(self.zones)
+
+    def clear(self):
+        self.zones = []
+        self.current = []
+        self.redraw()
+
+        # Outside edit mode there is no Save step to wait for, hand the empty list over at once
+        if not self.editing and self.on_change is not None:
+            self.on_change(self.zones)
+
+    def find_handle(self, x, y):
+        # Return (zone index or None for the polygon being drawn, point index) of the point under the cursor
+        width, height = self.frame_size()
+        polygons = [(index, zone.points) for index, zone in enumerate(self.zones)] + [(None, self.current)]
+        for zone_index, points in polygons:
+            for point_index, (px, py) in enumerate(points):
+                if abs(px * width - x) <= HANDLE_RADIUS and abs(py * height - y) <= HANDLE_RADIUS:
+                    return zone_index, point_index
+        return None
+
+    def on_press(self, event):
+        self.dragging = self.find_handle(event.x, event.y)
+        if self.dragging is None:
+            # Add a point to the polygon being drawn
+            width, height = self.frame_size()
+            self.current.append((min(max(event.x / width, 0.0), 1.0), min(max(event.y / height, 0.0), 1.0)))
+            self.redraw()
+
+    def on_drag(self, event):
+        if self.dragging is None:
+            return
+        width, height = self.frame_size()
+        point = (min(max(event.x / width, 0.0), 1.0), min(max(event.y / height, 0.0), 1.0))
+        zone_index, point_index = self.dragging
+        points = self.current if zone_index is None else self.zones[zone_index].points
+        points[point_index] = point
+        self.redraw()
+
+    def on_release(self, event):
+        self.dragging = None
+
+    def close_polygon(self, event=None):
+        # A polygon needs at least three distinct points and some area, anything less is dropped
+        if is_polygon(self.current):
+            self.zones.append(Zone(self.kind, self.current))
+        self.current = []
+        self.redraw()
+
+    def redraw(self):
+        # Zones are only drawn while editing, so this runs on mouse events and never per frame
+        self.canvas.delete("zone")
+        if not self.editing:
+            return
+        width, height = self.frame_size()
+        polygons = [(zone.kind, zone.points, True) for zone in self.zones] + [(self.kind, self.current, False)]
+        for kind, points, closed in polygons:
+            color = ZONE_COLORS[kind]
+            coords = [value for (x, y) in points for value in (x * width, y * height)]
+            if closed and len(points) >= 3:
+                self.canvas.create_polygon(*coords, outline=color, fill="", width=2, tags="zone")
+            elif len(points) >= 2:
+                self.canvas.create_line(*coords, fill=color, width=2, tags="zone")
+            for index in range(0, len(coords), 2):
+                x, y = coords[index], coords[index + 1]
+                self.canvas.create_oval(x - HANDLE_RADIUS, y - HANDLE_RADIUS, x + HANDLE_RADIUS, y + HANDLE_RADIUS,
+                                        outline=color, fill=color, tags="zone")
@@ -0,0 +1,126 @@
+import json
+import sqlite3
+
+import cv2
+import numpy as np
+
+INCLUDE = "include"
+EXCLUDE = "exclude"
+
+
+class Zone:
+    def __init__(self, kind, points):
+        # Points are (x, y) pairs relative to the frame size, from 0 to 1, so zones survive a resolution change
+        if kind not in (INCLUDE, EXCLUDE):
+            raise ValueError("zone kind must be %r or %r" % (INCLUDE, EXCLUDE))
+        self.kind = kind
+        self.points = [(float(x), float(y)) for (x, y) in points]
+
+    def pixel_points(self, width, height):
+        return np.array([(round(x * width), round(y * height)) for (x, y) in self.points], dtype=np.int32)
+
+
+def is_polygon(points):
+    # At least three distinct points enclosing some area, a line or a single point can't be rasterized into a zone
+    if len(set(points)) < 3:
+        return False
+    # Shoelace formula, zero for collinear points
+    area = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        area += x0 * y1 - x1 * y0
+    return area != 0.0
+
+
+class DetectionZones:
+    def __init__(self, zones):
+        self.zones = [zone for zone in zones if is_polygon(zone.points)]
+
+        # Rasterized masks per (frame size, scale), built once and reused for every frame
+        self.cache = {}
+
+    def roi(self, width, height):
+        # Bounding rectangle of the include zones, or the whole frame when there are none
+        includes = [zone.pixel_points(width, height) for zone in self.zones if zone.kind == INCLUDE]
+        if not includes:
+            return (0, 0, width, height)
+        x, y, w, h = cv2.boundingRect(np.concatenate(includes))
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(width, x + w), min(height, y + h)
+        return (x0, y0, max(1, x1 - x0), max(1, y1 - y0))
+
+    def mask(self, width, height, scale=1.0):
+        # Returns (roi, mask): the crop rectangle in full resolution pixels and the 0/255 mask
+        # for the cropped frame at the detection scale, or None when every pixel counts
+        key = (width, height, scale)
+        if key not in self.cache:
+            self.cache[key] = self.rasterize(width, height, scale)
+        return self.cache[key]
+
+    def rasterize(self, width, height, scale):
+        roi = self.roi(width, height)
+        if not self.zones:
+            return roi, None
+
+        # Draw the zones at full resolution: includes on, excludes off
+        has_includes = any(zone.kind == INCLUDE for zone in self.zones)
+        full = np.full((height, width), 0 if has_includes else 255, dtype=np.uint8)
+        for zone in self.zones:
+            if zone.kind == INCLUDE:
+                cv2.fillPoly(full, [zone.pixel_points(width, height)], 255)
+        for zone in self.zones:
+            if zone.kind == EXCLUDE:
+                cv2.fillPoly(full, [zone.pixel_points(width, height)], 0)
+
+        # Crop to the ROI and bring it to the size of the detection frame
+        x, y, w, h = roi
+        cropped = full[y:y + h, x:x + w]
+        if scale != 1.0:
+            # Same size MotionDetector.shrink() gives the cropped frame, at least one pixel
+            size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+            cropped = cv2.resize(cropped, size, interpolation=cv2.INTER_NEAREST)
+        return roi, np.ascontiguousarray(cropped)
+
+
+class ZoneStore:
+    def __init__(self, path="HomeSecurity.db"):
+        self.path = path
+
+        # Create the table if it doesn't exist
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute("""
+                    CREATE TABLE IF NOT EXISTS detection_zones (
+                        id INTEGER PRIMARY KEY,
+                        camera TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        points TEXT NOT NULL
+                    )
+                """)
+                connection.execute("CREATE INDEX IF NOT EXISTS detection_zones_camera ON detection_zones (camera)")
+        finally:
+            connection.close()
+
+    def load(self, camera):
+        # Zones of one camera, in the order they were drawn
+        connection = sqlite3.connect(self.path)
+        try:
+            rows = connection.execute(
+                "SELECT kind, points FROM detection_zones WHERE camera = ? ORDER BY id", (str(camera),)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [Zone(kind, json.loads(points)) for (kind, points) in rows]
+
+    def save(self, camera, zones):
+        # Replace the camera's zones in one transaction
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute("DELETE FROM detection_zones WHERE camera = ?", (str(camera),))
+                connection.executemany(
+                    "INSERT INTO detection_zones (camera, kind, points) VALUES (?, ?, ?)",
+                    [(str(camera), zone.kind, json.dumps(zone.points)) for zone in zones],
+                )
+        finally:
+            connection.close()